@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import datetime
+import gc
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'rechecks'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'jobs_time'))
+sys.path.append(REPO_DIR)
+
+from common import cache_store  # noqa: E402
+from common import charts  # noqa: E402
+from common import transport  # noqa: E402
+from common import zuul_report  # noqa: E402
+import aggregate  # noqa: E402
+import gerrit_query  # noqa: E402
+import job_timer  # noqa: E402
+import jobs_time  # noqa: E402
+import recheck_points  # noqa: E402
+import rechecks  # noqa: E402
+import synthetic  # noqa: E402
+import zuul_builds  # noqa: E402
+
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Measure time and memory used by each stage of '
+                    'rechecks.py, jobs_time.py and job_timer.py, and by the '
+                    'Zuul report parser, on a synthetic dataset. Results '
+                    'are saved, so they can be compared between versions.')
+    parser.add_argument(
+        '--changes',
+        type=int,
+        default=1000,
+        help='Number of changes in the generated dataset. Default: 1000')
+    parser.add_argument(
+        '--comments',
+        type=int,
+        default=10,
+        help='Number of comments on each change. Default: 10')
+    parser.add_argument(
+        '--failure-ratio',
+        type=float,
+        default=0.3,
+        help='Part of the Zuul check results which are failures. '
+             'Default: 0.3')
+    parser.add_argument(
+        '--dataset-dir',
+        default=None,
+        help='Use the dataset written by synthetic.py to this directory '
+             'instead of generating a new one.')
+    parser.add_argument(
+        '--tools',
+        default='rechecks,jobs_time,job_timer,zuul_report',
+        help='Comma separated list of the tools to benchmark. '
+             'Default: rechecks,jobs_time,job_timer,zuul_report')
+    parser.add_argument(
+        '--no-memory',
+        action='store_true',
+        help="Don't profile memory. Memory is profiled by running each "
+             "stage a second time with tracemalloc enabled.")
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='File where results are saved. Default: a new file in %s' %
+             RESULTS_DIR)
+    parser.add_argument(
+        '--compare',
+        default=None,
+        help='Results file of an earlier run to compare with.')
+
+    return parser.parse_args()
+
+
+def get_version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Benchmark(object):
+
+    def __init__(self, profile_memory=True):
+        self.profile_memory = profile_memory
+        self.results = []
+
+    def measure(self, tool, stage, func, *args):
+        """Run a stage and record its wall time and peak memory.
+
+        Memory is measured in a second run, as tracemalloc slows everything
+        down. Only memory allocated by this process is seen, not by worker
+        processes.
+        """
+        gc.collect()
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        peak = None
+        if self.profile_memory:
+            del result
+            gc.collect()
+            tracemalloc.start()
+            result = func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results.append({'tool': tool, 'stage': stage,
+                             'seconds': seconds, 'peak_bytes': peak})
+        print('%-10s %-22s %10.3fs %s' % (
+            tool, stage, seconds,
+            '' if peak is None else '%10.1f MiB' % (peak / 2 ** 20)))
+        return result
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+
+RECHECKS_QUERY = 'status:merged branch:master'
+CHANGES_PATH = '/changes/?q=branch:master'
+XSSI_PREFIX = b")]}'\n"
+
+
+def _get_listed(change):
+    # A change as listed without its messages.
+    return {key: value for key, value in change.items()
+            if key != 'messages'}
+
+
+def _save_changes_page(store, page_number, page):
+    for options, changes in (
+            (jobs_time.CHANGE_OPTIONS, page),
+            (jobs_time.LIST_OPTIONS, [_get_listed(c) for c in page])):
+        store.save(
+            transport.get_http_request('%s/%s%s&n=%d&S=%d' % (
+                jobs_time.HOST, CHANGES_PATH, options,
+                jobs_time.DEFAULT_PAGE_SIZE,
+                page_number * jobs_time.DEFAULT_PAGE_SIZE)),
+            XSSI_PREFIX + json.dumps(changes).encode('utf-8'))
+    if page:
+        # Messages of changes which aren't cached yet.
+        store.save(
+            transport.get_http_request(
+                '%s//changes/?q=%s%s&n=%d' % (
+                    jobs_time.HOST,
+                    '+OR+'.join('change:%s' % c['_number'] for c in page),
+                    jobs_time.CHANGE_OPTIONS, len(page))),
+            XSSI_PREFIX + json.dumps(page).encode('utf-8'))
+
+
+def write_fixtures(paths, fixtures_dir):
+    """Save the dataset as responses served by the replay transport.
+
+    Returns numbers of all the changes.
+    """
+    store = transport.FixtureStore(fixtures_dir)
+    with open(paths['gerrit_query'], 'rb') as query_file:
+        store.save_lines(
+            transport.get_ssh_request(
+                gerrit_query.GERRIT_HOST, gerrit_query.GERRIT_PORT,
+                ['gerrit', 'query', '--format=json', '--current-patch-set',
+                 '--comments', '--start', '0', RECHECKS_QUERY]),
+            query_file)
+
+    numbers = []
+    page = []
+    page_number = 0
+    with open(paths['rest_messages']) as rest_file:
+        for line in rest_file:
+            change = json.loads(line)
+            change['status'] = 'MERGED'
+            change['current_revision'] = '%040x' % change['_number']
+            numbers.append(change['_number'])
+            store.save(
+                transport.get_http_request('%s/changes/%s/messages' % (
+                    jobs_time.HOST, change['_number'])),
+                XSSI_PREFIX + json.dumps(change['messages']).encode('utf-8'))
+            store.save(
+                transport.get_http_request(
+                    '%s/changes/%s?o=CURRENT_REVISION' % (
+                        jobs_time.HOST, change['_number'])),
+                XSSI_PREFIX + json.dumps(_get_listed(change)).encode(
+                    'utf-8'))
+            if len(page) == jobs_time.DEFAULT_PAGE_SIZE:
+                # Only one page of changes is kept, it's saved as soon as
+                # it's known that more changes follow it.
+                page[-1]['_more_changes'] = True
+                _save_changes_page(store, page_number, page)
+                page = []
+                page_number += 1
+            page.append(change)
+    _save_changes_page(store, page_number, page)
+    # Pages past the last one are asked for when they are downloaded
+    # concurrently.
+    for i in range(jobs_time.DEFAULT_CONCURRENCY):
+        _save_changes_page(store, page_number + 1 + i, [])
+
+    # Single node jobs inherit their nodeset from a base job.
+    jobdefs = [{'name': 'base', 'nodeset': {'nodes': [{}]}}]
+    for job, _duration, _voting in synthetic.JOBS:
+        if 'multinode' in job:
+            jobdefs.append({'name': job, 'nodeset': {'nodes': [{}, {}]}})
+        else:
+            jobdefs.append({'name': job, 'parent': 'base'})
+    for jobdef in jobdefs:
+        store.save(
+            transport.get_http_request('%s/api/tenant/%s/job/%s' % (
+                job_timer.ZUUL, job_timer.TENANT, jobdef['name'])),
+            json.dumps([jobdef]).encode('utf-8'))
+    store.save(
+        transport.get_http_request('%s/api/tenant/%s/jobs' % (
+            job_timer.ZUUL, job_timer.TENANT)),
+        json.dumps([{'name': jobdef['name']} for jobdef in jobdefs]).encode(
+            'utf-8'))
+
+    # Builds are read one page at a time. The last page is always short,
+    # even if empty.
+    page_size = zuul_builds.DEFAULT_PAGE_SIZE
+    skip = 0
+    with open(paths['zuul_builds']) as builds_file:
+        while True:
+            builds = [json.loads(line)
+                      for line in itertools.islice(builds_file, page_size)]
+            store.save(
+                transport.get_http_request(
+                    '%s/api/tenant/%s/builds' % (zuul_builds.ZUUL,
+                                                 zuul_builds.TENANT),
+                    {'complete': 'true', 'skip': skip, 'limit': page_size}),
+                json.dumps(builds).encode('utf-8'))
+            if len(builds) < page_size:
+                break
+            skip += page_size
+    return numbers
+
+
+def bench_rechecks(benchmark, output_dir):
+    rechecks.args = argparse.Namespace(
+        report_format='human', rolling_days=None, verbose=False)
+
+    changes = benchmark.measure(
+        'rechecks', 'fetch', gerrit_query.fetch_changes, RECHECKS_QUERY)
+    benchmark.measure(
+        'rechecks', 'fetch+parse (stream)', gerrit_query.fetch_changes,
+        RECHECKS_QUERY, 1, gerrit_query.DEFAULT_SLICE_DAYS, None,
+        recheck_points.get_point_from_patch)
+    points = benchmark.measure(
+        'rechecks', 'parse', recheck_points.get_points_from_data,
+        changes, 1)
+    benchmark.measure(
+        'rechecks', 'parse (processes)',
+        recheck_points.get_points_from_data, changes)
+    del changes
+
+    def aggregate_all():
+        aggregator = aggregate.PointsAggregator(points)
+        for time_window in aggregate.TIME_WINDOWS:
+            aggregator.get_stats(time_window)
+        return aggregator
+
+    aggregator = benchmark.measure('rechecks', 'aggregate', aggregate_all)
+
+    def render():
+        with quiet():
+            rechecks.print_avg_rechecks(aggregator, 'week')
+        charts.render_chart(rechecks.get_avg_rechecks_chart(
+            aggregator.get_means('week'), 'week',
+            os.path.join(output_dir, 'rechecks.png')))
+        charts.render_chart(rechecks.get_patch_rechecks_chart(
+            points, os.path.join(output_dir, 'patches.png')))
+
+    benchmark.measure('rechecks', 'render', render)
+
+
+def bench_jobs_time(benchmark, output_dir):
+    def fetch():
+        with quiet():
+            return list(jobs_time.iter_changes(CHANGES_PATH))
+
+    changes = benchmark.measure('jobs_time', 'fetch', fetch)
+
+    def parse():
+        comments = (jobs_time.get_latest_zuul_comment(
+            change['_number'], change['messages']) for change in changes)
+        with quiet():
+            return [jobs_time.parse_job_info(msg) for msg, _week in comments
+                    if msg]
+
+    benchmark.measure('jobs_time', 'parse', parse)
+    del changes
+
+    def summarize(concurrency=1):
+        with quiet():
+            return jobs_time.get_summary(
+                jobs_time.iter_changes(CHANGES_PATH, concurrency=concurrency))
+
+    summary = benchmark.measure('jobs_time', 'fetch+parse+aggregate',
+                                summarize)
+    benchmark.measure('jobs_time', 'summary (threads)', summarize,
+                      jobs_time.DEFAULT_CONCURRENCY)
+
+    def summarize_cached(cold):
+        if cold:
+            cache_store.configure(tempfile.mkdtemp(dir=output_dir))
+        with quiet():
+            return jobs_time.get_summary(
+                jobs_time.iter_changes(CHANGES_PATH, use_cache=True))
+
+    benchmark.measure('jobs_time', 'summary (cold cache)', summarize_cached,
+                      True)
+    benchmark.measure('jobs_time', 'summary (warm cache)', summarize_cached,
+                      False)
+
+    def summarize_builds():
+        builds = zuul_builds.iter_builds(datetime.datetime(2000, 1, 1),
+                                         datetime.datetime.now())
+        with quiet():
+            return zuul_builds.get_summary(builds)
+
+    benchmark.measure('jobs_time', 'summary (zuul builds)', summarize_builds)
+
+    def render():
+        charts.render_chart(jobs_time.get_jobs_chart(
+            summary, os.path.join(output_dir, 'jobs.png')))
+
+    benchmark.measure('jobs_time', 'render', render)
+
+
+def bench_job_timer(benchmark, changes, output_dir):
+    def summarize():
+        # Every run starts without anything cached.
+        cache_store.configure(tempfile.mkdtemp(dir=output_dir))
+        job_timer.JOBCACHE.clear()
+        job_timer.NODES_INDEX = None
+        with quiet():
+            for change in changes:
+                job_timer.do_summary(change)
+
+    benchmark.measure('job_timer', 'fetch+parse+aggregate', summarize)
+
+    def summarize_batch():
+        cache_store.configure(tempfile.mkdtemp(dir=output_dir))
+        job_timer.JOBCACHE.clear()
+        job_timer.NODES_INDEX = None
+        with quiet():
+            return job_timer.get_node_time(job_timer.get_changes(changes))
+
+    benchmark.measure('job_timer', 'node time (batch)', summarize_batch)
+
+
+def bench_zuul_report(benchmark, paths):
+    with open(paths['rest_messages']) as rest_file:
+        comments = [message['message']
+                    for line in rest_file
+                    for message in json.loads(line)['messages']
+                    if message['author']['username'] == 'zuul']
+
+    def parse():
+        return [zuul_report.parse_report(comment) for comment in comments]
+
+    benchmark.measure('zuul_report', 'parse_report', parse)
+
+
+def compare(results, previous):
+    previous_results = {(r['tool'], r['stage']): r
+                        for r in previous['results']}
+    print('\nCompared with %s (%s):' % (previous['version'],
+                                        previous['date']))
+    for result in results['results']:
+        old = previous_results.get((result['tool'], result['stage']))
+        if not old:
+            continue
+        line = '%-10s %-22s time %+7.1f%%' % (
+            result['tool'], result['stage'],
+            100 * (result['seconds'] / old['seconds'] - 1))
+        if result['peak_bytes'] and old['peak_bytes']:
+            line += '  memory %+7.1f%%' % (
+                100 * (result['peak_bytes'] / old['peak_bytes'] - 1))
+        print(line)
+
+
+if __name__ == '__main__':
+    args = get_parser()
+    tools = args.tools.split(',')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dataset_dir = args.dataset_dir
+        if not dataset_dir:
+            dataset_dir = tmp_dir
+            synthetic.write_dataset(dataset_dir, args.changes, args.comments,
+                                    args.failure_ratio)
+        paths = {'gerrit_query': os.path.join(dataset_dir,
+                                              'gerrit_query.json'),
+                 'rest_messages': os.path.join(dataset_dir,
+                                               'rest_messages.json'),
+                 'zuul_builds': os.path.join(dataset_dir, 'zuul_builds.json')}
+
+        # Everything is served from disk by the replay transport, so the
+        # benchmarks never access the network.
+        fixtures_dir = os.path.join(tmp_dir, 'fixtures')
+        changes = write_fixtures(paths, fixtures_dir)
+        transport.configure('replay', fixtures_dir)
+        cache_store.configure(os.path.join(tmp_dir, 'cache'))
+
+        benchmark = Benchmark(profile_memory=not args.no_memory)
+        if 'rechecks' in tools:
+            bench_rechecks(benchmark, tmp_dir)
+        if 'jobs_time' in tools:
+            bench_jobs_time(benchmark, tmp_dir)
+        if 'job_timer' in tools:
+            bench_job_timer(benchmark, changes, tmp_dir)
+        if 'zuul_report' in tools:
+            bench_zuul_report(benchmark, paths)
+
+    now = datetime.datetime.now()
+    results = {'version': get_version(),
+               'date': now.isoformat(timespec='seconds'),
+               'dataset': {'changes': args.changes,
+                           'comments': args.comments,
+                           'failure_ratio': args.failure_ratio,
+                           'dataset_dir': args.dataset_dir},
+               'results': benchmark.results}
+    output = args.output
+    if not output:
+        try:
+            os.makedirs(RESULTS_DIR)
+        except OSError:
+            pass
+        output = os.path.join(RESULTS_DIR, '%s-%s.json' % (
+            now.strftime('%Y%m%d-%H%M%S'), results['version']))
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print('Results saved to %s' % output)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(results, json.load(previous_file))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import hashlib
+import heapq
+import json
+import os
+import random
+
+
+PROJECTS = [
+    'openstack/neutron',
+    'openstack/neutron-lib',
+    'openstack/neutron-tempest-plugin',
+    'openstack/networking-ovn',
+    'openstack/ovsdbapp',
+]
+
+# Job name, typical duration in seconds and whether it votes.
+JOBS = [
+    ('openstack-tox-pep8', 420, True),
+    ('openstack-tox-py38', 1500, True),
+    ('openstack-tox-py39', 1560, True),
+    ('neutron-functional-with-uwsgi', 3300, True),
+    ('neutron-fullstack-with-uwsgi', 4200, True),
+    ('neutron-tempest-plugin-api', 5400, True),
+    ('neutron-tempest-plugin-scenario-openvswitch', 6300, True),
+    ('neutron-tempest-plugin-scenario-ovn', 6600, True),
+    ('neutron-ovn-tempest-slow', 7800, False),
+    ('tempest-integrated-networking', 7200, True),
+    ('neutron-grenade-multinode', 8400, True),
+    ('neutron-ovs-rally-task', 5000, False),
+]
+
+FAILURE_STATUSES = ['FAILURE', 'FAILURE', 'FAILURE', 'TIMED_OUT',
+                    'POST_FAILURE', 'NODE_FAILURE', 'RETRY_LIMIT']
+
+GERRIT_URL = 'https://review.opendev.org'
+ZUUL_URL = 'https://zuul.opendev.org'
+START_DATE = datetime.datetime(2021, 1, 4)
+# Comments of a change are posted at most this many seconds apart.
+MAX_COMMENT_INTERVAL = 86400
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic Gerrit/Zuul dataset for the '
+                    'benchmarks. Both the "gerrit query --format=json" '
+                    'output and the REST API messages of the same changes '
+                    'are written.')
+    parser.add_argument(
+        '--changes',
+        type=int,
+        default=1000,
+        help='Number of merged changes to generate. Default: 1000')
+    parser.add_argument(
+        '--comments',
+        type=int,
+        default=10,
+        help='Number of comments on each change. Default: 10')
+    parser.add_argument(
+        '--failure-ratio',
+        type=float,
+        default=0.3,
+        help='Part of the Zuul check results which are failures. '
+             'Default: 0.3')
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of the random generator. Default: 0')
+    parser.add_argument(
+        '--output-dir',
+        default='dataset',
+        help='Directory where the dataset is written. Default: dataset')
+
+    return parser.parse_args()
+
+
+def make_human_time(sec):
+    timestr = []
+    if sec >= 3600:
+        timestr.append('%ih' % (sec / 3600))
+        sec %= 3600
+    if sec >= 60:
+        timestr.append('%im' % (sec / 60))
+        sec %= 60
+    timestr.append('%is' % sec)
+    return ' '.join(timestr)
+
+
+def make_job_results(rng, failed):
+    """Return (job, build, status, seconds, voting) of every job of a build.
+
+    Jobs which didn't run have no duration.
+    """
+    results = []
+    failed_job = rng.randrange(len(JOBS)) if failed else None
+    for i, (job, duration, voting) in enumerate(JOBS):
+        status = 'SUCCESS'
+        if i == failed_job:
+            status = rng.choice(FAILURE_STATUSES)
+        build = '%032x' % rng.getrandbits(128)
+        seconds = None
+        if status != 'NODE_FAILURE':
+            seconds = int(rng.gauss(duration, duration * 0.1))
+        results.append((job, build, status, seconds, voting))
+    return results
+
+
+def make_zuul_message(patch_set, pipeline, failed, results):
+    if failed:
+        header = 'Build failed (%s pipeline).' % pipeline
+        vote = 'Verified-2' if pipeline == 'gate' else 'Verified-1'
+    else:
+        header = 'Build succeeded (%s pipeline).' % pipeline
+        vote = 'Verified+2' if pipeline == 'gate' else 'Verified+1'
+    lines = ['Patch Set %s: %s' % (patch_set, vote), '', header,
+             'For information on how to proceed, see '
+             'https://docs.opendev.org/opendev/infra-manual/latest/'
+             'developers.html#automated-testing', '']
+    for job, build, status, seconds, voting in results:
+        line = '- %s %s/t/openstack/build/%s : %s' % (
+            job, ZUUL_URL, build, status)
+        if seconds is not None:
+            line += ' in %s' % make_human_time(seconds)
+        if not voting:
+            line += ' (non-voting)'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def make_zuul_comment(rng, timestamp, patch_set, pipeline, failed):
+    results = make_job_results(rng, failed)
+    return (timestamp, 'zuul', patch_set,
+            make_zuul_message(patch_set, pipeline, failed, results),
+            {'pipeline': pipeline, 'results': results})
+
+
+def iter_synthetic_changes(changes, comments, failure_ratio, seed=0):
+    """Yield changes in a format-neutral form, newest first like Gerrit.
+
+    Every change has its messages as (timestamp, author, patch set, text,
+    build) tuples, in the order they were posted. Build is the pipeline and
+    results of the jobs reported by Zuul comments, None for other comments.
+    """
+    rng = random.Random(seed)
+    span = 365 * 86400
+    start = int(START_DATE.timestamp())
+    for n in reversed(range(changes)):
+        number = 700000 + n
+        created = start + int(span * n / max(changes, 1))
+        last_ps = rng.randint(1, 6)
+        timestamp = created
+        messages = []
+        for i in range(comments):
+            timestamp += rng.randint(600, MAX_COMMENT_INTERVAL)
+            patch_set = min(last_ps, 1 + i * last_ps // max(comments, 1))
+            if i == comments - 1:
+                messages.append(make_zuul_comment(rng, timestamp, last_ps,
+                                                  'gate', False))
+            elif i == comments - 2 or rng.random() < 0.6:
+                # Check always passes right before the change is gated.
+                failed = i != comments - 2 and rng.random() < failure_ratio
+                messages.append(make_zuul_comment(rng, timestamp, patch_set,
+                                                  'check', failed))
+            else:
+                messages.append((timestamp, 'reviewer%d' % rng.randint(1, 50),
+                                 patch_set,
+                                 'Patch Set %s: Code-Review+2\n\nLooks good.'
+                                 % patch_set, None))
+        yield {
+            'number': number,
+            'id': 'I%s' % hashlib.sha1(str(number).encode()).hexdigest(),
+            'project': PROJECTS[n % len(PROJECTS)],
+            'subject': 'Synthetic change %s' % number,
+            'created': created,
+            'merged': timestamp + 60,
+            'last_ps': last_ps,
+            'messages': messages,
+        }
+
+
+def to_gerrit_query_change(change):
+    url = '%s/c/%s/+/%s' % (GERRIT_URL, change['project'], change['number'])
+    return {
+        'project': change['project'],
+        'branch': 'master',
+        'id': change['id'],
+        'number': change['number'],
+        'subject': change['subject'],
+        'owner': {'name': 'Owner', 'username': 'owner'},
+        'url': url,
+        'createdOn': change['created'],
+        'lastUpdated': change['merged'],
+        'open': False,
+        'status': 'MERGED',
+        'comments': [
+            {'timestamp': timestamp,
+             'reviewer': {'name': 'Zuul' if author == 'zuul' else author,
+                          'username': author},
+             'message': text}
+            for timestamp, author, _patch_set, text, _build in
+            change['messages']],
+        'currentPatchSet': {
+            'number': change['last_ps'],
+            'revision': hashlib.sha1(change['id'].encode()).hexdigest(),
+            'approvals': [
+                {'type': 'SUBM', 'value': '1',
+                 'grantedOn': change['merged']}]},
+    }
+
+
+def _get_rest_date(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime(
+        '%Y-%m-%d %H:%M:%S.000000000')
+
+
+def to_rest_messages(change):
+    return [
+        {'id': '%s_%s' % (change['number'], i),
+         'author': {'name': 'Zuul' if author == 'zuul' else author,
+                    'username': author},
+         'date': _get_rest_date(timestamp),
+         'message': text,
+         '_revision_number': patch_set}
+        for i, (timestamp, author, patch_set, text, _build) in
+        enumerate(change['messages'])]
+
+
+def _get_zuul_time(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime(
+        '%Y-%m-%dT%H:%M:%S')
+
+
+def iter_zuul_builds(change):
+    """Yield builds of the change as the Zuul builds API would.
+
+    Every build comes with the timestamp it started at.
+    """
+    for timestamp, _author, patch_set, _text, build in change['messages']:
+        if not build:
+            continue
+        for job, uuid, status, seconds, voting in build['results']:
+            # The comment is posted when the longest job ends.
+            start = timestamp - (seconds or 0)
+            yield start, {
+                'uuid': uuid,
+                'job_name': job,
+                'result': status,
+                'start_time': _get_zuul_time(start),
+                'end_time': _get_zuul_time(timestamp),
+                'duration': seconds,
+                'voting': voting,
+                'pipeline': build['pipeline'],
+                'project': change['project'],
+                'branch': 'master',
+                'change': change['number'],
+                'patchset': str(patch_set),
+                'log_url': '%s/logs/%s/' % (ZUUL_URL, uuid)}
+
+
+def _write_build(builds_file, build):
+    builds_file.write(json.dumps(build))
+    builds_file.write('\n')
+
+
+def write_dataset(output_dir, changes, comments, failure_ratio, seed=0):
+    """Write the dataset files and return their paths.
+
+    ``gerrit_query.json`` holds the output of a "gerrit query
+    --format=json --comments --current-patch-set" run, and
+    ``rest_messages.json`` has one line per change with its number, project
+    and the body of its "changes/<number>/messages" REST API response.
+    ``zuul_builds.json`` has one line per build, as returned by the Zuul
+    builds API, newest first.
+    """
+    try:
+        os.makedirs(output_dir)
+    except OSError:
+        pass
+    paths = {'gerrit_query': os.path.join(output_dir, 'gerrit_query.json'),
+             'rest_messages': os.path.join(output_dir, 'rest_messages.json'),
+             'zuul_builds': os.path.join(output_dir, 'zuul_builds.json')}
+    # Like the builds API, newest builds first. Changes are generated newest
+    # first, and builds of older changes can't start later than the last
+    # comment of this one could be posted, so only builds after that have
+    # to wait to be sorted.
+    builds = []
+    with open(paths['gerrit_query'], 'w') as query_file, \
+            open(paths['rest_messages'], 'w') as rest_file, \
+            open(paths['zuul_builds'], 'w') as builds_file:
+        for change in iter_synthetic_changes(changes, comments,
+                                             failure_ratio, seed):
+            query_file.write(json.dumps(to_gerrit_query_change(change)))
+            query_file.write('\n')
+            rest_file.write(json.dumps(
+                {'_number': change['number'], 'project': change['project'],
+                 'messages': to_rest_messages(change)}))
+            rest_file.write('\n')
+            for start, build in iter_zuul_builds(change):
+                heapq.heappush(builds, (-start, build['uuid'], build))
+            last_start = change['created'] + comments * MAX_COMMENT_INTERVAL
+            while builds and -builds[0][0] > last_start:
+                _write_build(builds_file, heapq.heappop(builds)[2])
+        query_file.write(json.dumps(
+            {'type': 'stats', 'rowCount': changes,
+             'runTimeMilliseconds': 0, 'moreChanges': False}))
+        query_file.write('\n')
+        while builds:
+            _write_build(builds_file, heapq.heappop(builds)[2])
+    return paths
+
+
+if __name__ == '__main__':
+    args = get_parser()
+    paths = write_dataset(args.output_dir, args.changes, args.comments,
+                          args.failure_ratio, args.seed)
+    for name, path in sorted(paths.items()):
+        print('%s: %s' % (name, path))
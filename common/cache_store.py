@@ -0,0 +1,252 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+LOG = logging.getLogger(__name__)
+
+# Environment variables which move the cache and bound its size. The
+# --cache-dir and --cache-max-size options of rechecks.py take precedence
+# over them.
+CACHE_DIR_ENV = 'TOOLS_CACHE_DIR'
+MAX_SIZE_ENV = 'TOOLS_CACHE_MAX_SIZE'
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'tools')
+DEFAULT_MAX_SIZE = 2 * 2 ** 30
+
+MAGIC = b'TOOLSCACHE1\n'
+# Most of the cached data is JSON, which compresses well even at a low
+# level, and higher levels cost more time than they save space.
+COMPRESS_LEVEL = 3
+# How long to wait for other processes holding the index lock.
+LOCK_TIMEOUT = 60
+# Last access times are only updated when they are older than this many
+# seconds, so that most reads don't need to write to the index.
+ACCESS_RESOLUTION = 600
+# The size of the cache is checked when the entries written since the last
+# check add up to this part of its limit.
+EVICT_FRACTION = 0.01
+
+_cache = None
+
+
+class CacheStore(object):
+    """Bounded cache of values on disk, shared by all the tools.
+
+    Every entry is kept compressed in its own file, named after the hash of
+    its key, so it is found without listing any directory. An SQLite index
+    next to the entries holds their sizes, expiration and last access times;
+    when the entries grow over ``max_size`` bytes, the least recently used
+    ones are removed. Entries are written to temporary files and renamed,
+    so processes using the cache at the same time never see a half written
+    one.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._index_path = os.path.join(path, 'index.sqlite')
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        self._local = threading.local()
+        # Bytes written since the size was last checked, None when it wasn't
+        # checked yet.
+        self._unchecked = None
+
+    def _init(self):
+        with self._init_lock:
+            if self._initialized:
+                return
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                pass
+            with self._connect() as connection:
+                # Readers don't block the writer and the other way around,
+                # and commits are much cheaper than with a rollback journal.
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS entries ('
+                    'hash TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                    'expires REAL, last_access REAL NOT NULL)')
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS entries_last_access '
+                    'ON entries (last_access)')
+            self._initialized = True
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Every thread of every process has its own connection, so the cache
+        # can be used from many of them at once; SQLite serializes the
+        # writes.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._index_path,
+                                         timeout=LOCK_TIMEOUT)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        with connection:
+            yield connection
+
+    def _get_hash(self, key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _get_path(self, key_hash):
+        return os.path.join(self.path, key_hash[:2], key_hash)
+
+    def _remove_file(self, key_hash):
+        try:
+            os.remove(self._get_path(key_hash))
+        except OSError:
+            pass
+
+    def get(self, key):
+        """Return the value stored under the key, or None."""
+        self._init()
+        key_hash = self._get_hash(key)
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT expires, last_access FROM entries WHERE hash = ?',
+                (key_hash,)).fetchone()
+            if row is None:
+                return None
+            expires, last_access = row
+            if expires is not None and expires <= now:
+                LOG.debug('Cache entry %s expired', key)
+                connection.execute('DELETE FROM entries WHERE hash = ?',
+                                   (key_hash,))
+                self._remove_file(key_hash)
+                return None
+            if now - last_access > ACCESS_RESOLUTION:
+                connection.execute(
+                    'UPDATE entries SET last_access = ? WHERE hash = ?',
+                    (now, key_hash))
+
+        try:
+            with open(self._get_path(key_hash), 'rb') as entry_file:
+                content = entry_file.read()
+        except OSError:
+            self.delete(key)
+            return None
+        header = MAGIC + key.encode('utf-8') + b'\n'
+        if not content.startswith(header):
+            LOG.debug('Cache entry %s is not valid', key)
+            return None
+        return zlib.decompress(content[len(header):])
+
+    def put(self, key, value, ttl=None):
+        """Store bytes under the key, for ``ttl`` seconds if it's given."""
+        self._init()
+        key_hash = self._get_hash(key)
+        path = self._get_path(key_hash)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        tmp_path = '%s.%s.%s.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as entry_file:
+            entry_file.write(MAGIC + key.encode('utf-8') + b'\n')
+            entry_file.write(zlib.compress(value, COMPRESS_LEVEL))
+            size = entry_file.tell()
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO entries '
+                '(hash, size, expires, last_access) VALUES (?, ?, ?, ?)',
+                (key_hash, size, expires, now))
+        if self._unchecked is not None:
+            self._unchecked += size
+        if (self._unchecked is None or
+                self._unchecked >= self.max_size * EVICT_FRACTION):
+            self.evict()
+
+    def delete(self, key):
+        self._init()
+        key_hash = self._get_hash(key)
+        with self._connect() as connection:
+            connection.execute('DELETE FROM entries WHERE hash = ?',
+                               (key_hash,))
+            self._remove_file(key_hash)
+
+    def get_json(self, key):
+        value = self.get(key)
+        if value is None:
+            return None
+        return json.loads(value.decode('utf-8'))
+
+    def put_json(self, key, value, ttl=None):
+        self.put(key, json.dumps(value).encode('utf-8'), ttl)
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones."""
+        self._init()
+        self._unchecked = 0
+        with self._connect() as connection:
+            # Taking the write lock first makes concurrent evictions wait
+            # for each other, instead of removing the same entries.
+            connection.execute('BEGIN IMMEDIATE')
+            expired = connection.execute(
+                'SELECT hash FROM entries WHERE expires <= ?',
+                (time.time(),)).fetchall()
+            total, = connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM entries '
+                'WHERE expires IS NULL OR expires > ?',
+                (time.time(),)).fetchone()
+            removed = [key_hash for key_hash, in expired]
+            if total > self.max_size:
+                for key_hash, size in connection.execute(
+                        'SELECT hash, size FROM entries '
+                        'WHERE expires IS NULL OR expires > ? '
+                        'ORDER BY last_access', (time.time(),)):
+                    removed.append(key_hash)
+                    total -= size
+                    if total <= self.max_size:
+                        break
+            if not removed:
+                return
+            connection.executemany('DELETE FROM entries WHERE hash = ?',
+                                   ((key_hash,) for key_hash in removed))
+            for key_hash in removed:
+                self._remove_file(key_hash)
+        LOG.debug('Removed %s entries from the cache', len(removed))
+
+
+def parse_size(size):
+    """Parse a size like "500M" or "2G" to a number of bytes."""
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+    size = str(size).strip().upper()
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def configure(path=None, max_size=None):
+    """Choose the cache returned by get_cache().
+
+    When not given, the location and the size limit are taken from the
+    TOOLS_CACHE_DIR and TOOLS_CACHE_MAX_SIZE environment variables.
+    """
+    global _cache
+
+    path = path or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+    max_size = max_size or os.environ.get(MAX_SIZE_ENV) or DEFAULT_MAX_SIZE
+    _cache = CacheStore(path, parse_size(max_size))
+    return _cache
+
+
+def get_cache():
+    if _cache is None:
+        configure()
+    return _cache
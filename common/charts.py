@@ -0,0 +1,149 @@
+import datetime
+import os
+from concurrent import futures
+
+import numpy as np
+
+
+# Series longer than this are downsampled before they are drawn.
+DEFAULT_MAX_POINTS = 1000
+# At most this many labels are put on a categorical x axis.
+MAX_TICKS = 40
+FORMATS = ('png', 'svg')
+
+
+def lttb(x, y, threshold):
+    """Downsample a series with the Largest-Triangle-Three-Buckets method.
+
+    Returns indexes of the points to keep, which preserve the visual shape
+    of the series: in every bucket, the point forming the largest triangle
+    with the point kept in the previous bucket and the average of the next
+    bucket is chosen.
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # The first and the last points are always kept, the others are split
+    # into threshold - 2 buckets.
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    indexes = np.empty(threshold, dtype=np.int64)
+    indexes[0] = 0
+    indexes[-1] = length - 1
+    last = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_end = edges[i + 2]
+        else:
+            next_end = length
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs(
+            (x[last] - avg_x) * (y[start:end] - y[last]) -
+            (x[last] - x[start:end]) * (avg_y - y[last]))
+        last = start + int(np.argmax(areas))
+        indexes[i + 1] = last
+    return indexes
+
+
+def _is_date(value):
+    return isinstance(value, (datetime.date, datetime.datetime))
+
+
+def _get_numeric_x(x):
+    from matplotlib import dates
+
+    if not len(x):
+        return np.array([]), None
+    if isinstance(x[0], str):
+        return np.arange(len(x), dtype=np.float64), list(x)
+    if _is_date(x[0]):
+        return np.asarray(dates.date2num(x)), None
+    return np.asarray(x, dtype=np.float64), None
+
+
+def _draw(ax, spec, max_points):
+    categories = None
+    has_dates = False
+    for series in spec['series']:
+        x, series_categories = _get_numeric_x(series['x'])
+        categories = categories or series_categories
+        has_dates = has_dates or bool(len(x) and _is_date(series['x'][0]))
+        y = np.asarray(series['y'], dtype=np.float64)
+        keep = lttb(x, y, max_points)
+        ax.plot(x[keep], y[keep], label=series.get('label'))
+
+    if categories:
+        step = max(1, len(categories) // MAX_TICKS)
+        ticks = list(range(0, len(categories), step))
+        ax.set_xticks(ticks)
+        ax.set_xticklabels([categories[i] for i in ticks],
+                           rotation='vertical')
+    elif has_dates:
+        ax.xaxis_date()
+        for label in ax.get_xticklabels():
+            label.set_rotation('vertical')
+    if spec.get('title'):
+        ax.set_title(spec['title'])
+    ax.set_xlabel(spec.get('xlabel', ''))
+    ax.set_ylabel(spec.get('ylabel', ''))
+    if any(series.get('label') for series in spec['series']):
+        ax.legend(fontsize='small')
+
+
+def render_chart(spec, max_points=DEFAULT_MAX_POINTS):
+    """Render a chart straight to the file given in its spec.
+
+    The spec is a dict with the chart's "path", "title", "xlabel", "ylabel"
+    and a list of "series", each a dict with "label", "x" and "y" values.
+    X values can be numbers, dates or strings (categories). No display is
+    needed, as the Agg renderer is used directly.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=spec.get('size', (12, 7)))
+    FigureCanvasAgg(figure)
+    _draw(figure.add_subplot(), spec, max_points)
+    figure.tight_layout()
+    directory = os.path.dirname(spec['path'])
+    if directory:
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+    figure.savefig(spec['path'])
+    return spec['path']
+
+
+def show_chart(spec, max_points=DEFAULT_MAX_POINTS):
+    """Show a chart in a window of the interactive matplotlib backend."""
+    import matplotlib.pyplot as plt
+
+    figure, ax = plt.subplots()
+    _draw(ax, spec, max_points)
+    plt.show()
+    plt.close(figure)
+
+
+def _render_chart(args):
+    return render_chart(*args)
+
+
+def export_charts(specs, processes=None, max_points=DEFAULT_MAX_POINTS):
+    """Render many charts to files at once with a pool of processes."""
+    specs = list(specs)
+    if processes == 1 or len(specs) < 2:
+        return [render_chart(spec, max_points) for spec in specs]
+    with futures.ProcessPoolExecutor(processes) as executor:
+        return list(executor.map(
+            _render_chart, ((spec, max_points) for spec in specs)))
+
+
+def get_chart_path(directory, name, chart_format):
+    safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_'
+                        for c in name)
+    return os.path.join(directory, '%s.%s' % (safe_name, chart_format))
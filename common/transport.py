@@ -0,0 +1,303 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+
+import requests
+from requests import adapters
+
+
+LOG = logging.getLogger(__name__)
+
+MODES = ('live', 'record', 'replay')
+
+# job_timer.py has no options to choose the transport, these environment
+# variables are read instead.
+MODE_ENV = 'TOOLS_TRANSPORT'
+FIXTURES_DIR_ENV = 'TOOLS_FIXTURES_DIR'
+DEFAULT_FIXTURES_DIR = 'fixtures'
+
+# All ssh calls to a host share one multiplexed connection, so only the
+# first one pays for the handshake.
+SSH_CONTROL_PATH = os.path.expanduser('~/.ssh/tools-%r@%h:%p')
+SSH_CONTROL_PERSIST = '120'
+# Processes check for a running master and start it one at a time.
+SSH_MASTER_LOCK = os.path.expanduser('~/.ssh/tools-master.lock')
+
+# Number of kept alive HTTPS connections to each host. Requests sent by more
+# threads than this at once don't fail, but open connections which aren't
+# reused.
+DEFAULT_POOL_SIZE = 16
+# Failed requests are retried this many times, waiting twice as long before
+# every next try, starting with RETRY_BACKOFF seconds.
+DEFAULT_RETRIES = 4
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_transport = None
+
+
+class TransportError(Exception):
+    pass
+
+
+def get_ssh_request(host, port, command):
+    return {'kind': 'ssh', 'host': host, 'port': str(port),
+            'command': list(command)}
+
+
+def get_http_request(url, params=None):
+    return {'kind': 'http', 'url': url, 'params': params or {}}
+
+
+class RateLimiter(object):
+    """Spaces calls of wait() so that at most ``rate`` pass in a second.
+
+    It can be shared by many threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class LiveTransport(object):
+    """Talks to the real services over ssh and HTTPS.
+
+    HTTPS requests share a pool of kept alive connections, so the transport
+    can be used by many threads at once. With ``max_rate`` at most so many
+    requests are sent in a second. Requests failing with connection errors
+    or with statuses in RETRY_STATUSES are retried with exponential
+    backoff.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, max_rate=None,
+                 retries=DEFAULT_RETRIES):
+        self.session = requests.Session()
+        adapter = adapters.HTTPAdapter(pool_connections=pool_size,
+                                       pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiter = RateLimiter(max_rate) if max_rate else None
+        self.retries = retries
+        self._ssh_masters = set()
+        self._ssh_lock = threading.Lock()
+
+    def _ssh_options(self, port):
+        return ['-p', str(port),
+                '-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=%s' % SSH_CONTROL_PATH]
+
+    def _check_ssh_master(self, host, port):
+        return not subprocess.call(
+            ['ssh', '-O', 'check'] + self._ssh_options(port) + [host],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _start_ssh_master(self, host, port):
+        # The master is started in the background with its output detached,
+        # so that it doesn't keep pipes of the command processes open.
+        with self._ssh_lock:
+            if (host, port) in self._ssh_masters:
+                return
+            self._ssh_masters.add((host, port))
+            # A master left by an earlier run, or started by another worker
+            # of a batch, is reused. Starting another one with
+            # ControlMaster=yes would leave a plain connection running
+            # forever in the background.
+            try:
+                # Neither ssh nor open() create the directory of the control
+                # socket and of the lock.
+                os.makedirs(os.path.dirname(SSH_MASTER_LOCK), 0o700)
+            except OSError:
+                pass
+            with open(SSH_MASTER_LOCK, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if self._check_ssh_master(host, port):
+                    return
+                command = (['ssh', '-fN'] + self._ssh_options(port) +
+                           ['-o', 'ControlMaster=yes',
+                            '-o', 'ControlPersist=%s' % SSH_CONTROL_PERSIST,
+                            host])
+                returncode = subprocess.call(
+                    command, stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+            if returncode:
+                LOG.debug('Could not start ssh master connection to %s, '
+                          'every command will open its own connection', host)
+
+    def ssh_lines(self, host, port, command):
+        """Run a command over ssh and yield lines of its output."""
+        self._start_ssh_master(host, port)
+        # Errors go to a file, a pipe which nobody reads while the output is
+        # read could fill up and block ssh.
+        with tempfile.TemporaryFile() as error_file:
+            process = subprocess.Popen(
+                ['ssh'] + self._ssh_options(port) + [host] + list(command),
+                stdout=subprocess.PIPE, stderr=error_file)
+            for line in process.stdout:
+                yield line
+            process.wait()
+            error_file.seek(0)
+            error = error_file.read()
+        if error:
+            raise TransportError(error.decode('utf-8', 'replace'))
+
+    def _get_retry_delay(self, attempt, response=None):
+        retry_after = response is not None and response.headers.get(
+            'Retry-After')
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        # Jitter keeps many threads from retrying all at the same time.
+        return RETRY_BACKOFF * 2 ** attempt * random.uniform(1, 1.5)
+
+    def http_get(self, url, params=None):
+        """Return the body of the response to a GET request."""
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+            response = None
+            try:
+                response = self.session.get(url, params=params)
+                response.raise_for_status()
+                return response.content
+            except requests.RequestException as e:
+                if (attempt == self.retries or (
+                        response is not None and
+                        response.status_code not in RETRY_STATUSES)):
+                    raise TransportError('GET %s failed: %s' % (url, e))
+                delay = self._get_retry_delay(attempt, response)
+                LOG.debug('GET %s failed: %s, retrying in %.1fs',
+                          url, e, delay)
+                time.sleep(delay)
+
+
+class FixtureStore(object):
+    """Responses saved on disk, one file per request.
+
+    Every file starts with a JSON line describing the request, followed by
+    the response body as it was received.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _get_path(self, request):
+        key = hashlib.sha1(
+            json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def save(self, request, body):
+        self.save_lines(request, [body])
+
+    def save_lines(self, request, lines):
+        """Save a response body given as an iterable of byte strings."""
+        path = self._get_path(request)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        tmp_path = '%s.%s.%s.tmp' % (path, os.getpid(),
+                                     threading.get_ident())
+        with open(tmp_path, 'wb') as fixture_file:
+            fixture_file.write(json.dumps(request, sort_keys=True).encode(
+                'utf-8'))
+            fixture_file.write(b'\n')
+            for line in lines:
+                fixture_file.write(line)
+        os.replace(tmp_path, path)
+
+    def _open(self, request):
+        try:
+            fixture_file = open(self._get_path(request), 'rb')
+        except OSError:
+            raise TransportError('No recorded response for %s' %
+                                 json.dumps(request, sort_keys=True))
+        fixture_file.readline()
+        return fixture_file
+
+    def load(self, request):
+        with self._open(request) as fixture_file:
+            return fixture_file.read()
+
+    def iter_lines(self, request):
+        with self._open(request) as fixture_file:
+            for line in fixture_file:
+                yield line
+
+
+class RecordingTransport(object):
+    """Passes requests to another transport and saves the responses."""
+
+    def __init__(self, fixtures_dir, transport=None, **options):
+        self.store = FixtureStore(fixtures_dir)
+        self.transport = transport or LiveTransport(**options)
+
+    def ssh_lines(self, host, port, command):
+        lines = []
+        for line in self.transport.ssh_lines(host, port, command):
+            lines.append(line)
+            yield line
+        self.store.save(get_ssh_request(host, port, command),
+                        b''.join(lines))
+
+    def http_get(self, url, params=None):
+        body = self.transport.http_get(url, params)
+        self.store.save(get_http_request(url, params), body)
+        return body
+
+
+class ReplayTransport(object):
+    """Serves responses saved by RecordingTransport, never the network."""
+
+    def __init__(self, fixtures_dir):
+        self.store = FixtureStore(fixtures_dir)
+
+    def ssh_lines(self, host, port, command):
+        return self.store.iter_lines(get_ssh_request(host, port, command))
+
+    def http_get(self, url, params=None):
+        return self.store.load(get_http_request(url, params))
+
+
+def configure(mode=None, fixtures_dir=None, **options):
+    """Choose the transport used by get_transport().
+
+    When not given, the mode and the fixtures directory are taken from the
+    TOOLS_TRANSPORT and TOOLS_FIXTURES_DIR environment variables. Other
+    options are passed to LiveTransport.
+    """
+    global _transport
+
+    mode = mode or os.environ.get(MODE_ENV) or 'live'
+    fixtures_dir = (fixtures_dir or os.environ.get(FIXTURES_DIR_ENV) or
+                    DEFAULT_FIXTURES_DIR)
+    if mode == 'live':
+        _transport = LiveTransport(**options)
+    elif mode == 'record':
+        _transport = RecordingTransport(fixtures_dir, **options)
+    elif mode == 'replay':
+        _transport = ReplayTransport(fixtures_dir)
+    else:
+        raise ValueError('Unknown transport %s' % mode)
+    return _transport
+
+
+def get_transport():
+    if _transport is None:
+        configure()
+    return _transport
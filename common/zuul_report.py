@@ -0,0 +1,46 @@
+import collections
+import re
+
+
+JobResult = collections.namedtuple(
+    'JobResult', ['job', 'url', 'status', 'seconds', 'voting'])
+
+# Result lines of the jobs in Zuul comments, like:
+# - neutron-functional https://zuul.opendev.org/t/... : FAILURE in 1h 2m 3s
+# - neutron-ovn-tempest-slow https://... : SUCCESS in 2h 03m 5s (non-voting)
+# - openstack-tox-pep8 https://zuul.opendev.org/t/... : NODE_FAILURE
+# - openstack-tox-py38 : SKIPPED
+# Jobs which didn't run have no duration, and jobs which didn't start may
+# have no URL. The duration is matched in parts, so converting it to seconds
+# needs no further parsing.
+RESULT_PATTERN = (
+    r"^- (\S+) (?:(\S+) )?: ([A-Z_]+)"
+    r"(?: in (?:(\d+)d ?)?(?:(\d+)h ?)?(?:(\d+)m ?)?(?:(\d+)s)?)?"
+    r"( \(non-voting\))?")
+RESULT_REGEX = re.compile(RESULT_PATTERN, re.MULTILINE)
+
+
+def _get_result(job, url, status, days, hours, minutes, seconds,
+                non_voting):
+    if days or hours or minutes or seconds:
+        seconds = ((int(days) * 86400 if days else 0) +
+                   (int(hours) * 3600 if hours else 0) +
+                   (int(minutes) * 60 if minutes else 0) +
+                   (int(seconds) if seconds else 0))
+    else:
+        seconds = None
+    return JobResult(job, url or None, status, seconds, not non_voting)
+
+
+def iter_results(message, start=0):
+    """Yield JobResults of all the jobs reported in a Zuul comment.
+
+    The duration is None for jobs which didn't run, like SKIPPED or
+    NODE_FAILURE ones.
+    """
+    for match in RESULT_REGEX.finditer(message, start):
+        yield _get_result(*match.groups())
+
+
+def parse_report(message):
+    return list(iter_results(message))
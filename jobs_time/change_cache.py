@@ -0,0 +1,60 @@
+from common import cache_store
+
+# Comments on closed changes never change, so they are cached for good.
+# Comments on open changes are always downloaded again.
+CLOSED_STATUSES = ('MERGED', 'ABANDONED')
+# Job definitions do change, but rarely.
+ZUUL_JOB_TTL = 7 * 86400
+
+
+def _get_messages_key(number, revision):
+    return 'gerrit-messages:%s:%s' % (number, revision)
+
+
+def _strip_message(message):
+    # Only what the tools look at is kept.
+    return {'author': {'username':
+                       message.get('author', {}).get('username')},
+            'date': message.get('date'),
+            'message': message.get('message'),
+            '_revision_number': message.get('_revision_number')}
+
+
+def is_cacheable(change):
+    return change.get('status') in CLOSED_STATUSES
+
+
+def get_messages(change):
+    """Return cached messages of the change, or None."""
+    if not is_cacheable(change):
+        return None
+    return cache_store.get_cache().get_json(
+        _get_messages_key(change['_number'], change['current_revision']))
+
+
+def save_messages(change, messages):
+    if not is_cacheable(change):
+        return
+    cache_store.get_cache().put_json(
+        _get_messages_key(change['_number'], change['current_revision']),
+        [_strip_message(message) for message in messages])
+
+
+def get_zuul_job(zuul, tenant, name):
+    return cache_store.get_cache().get_json(
+        'zuul-job:%s:%s:%s' % (zuul, tenant, name))
+
+
+def save_zuul_job(zuul, tenant, name, job):
+    cache_store.get_cache().put_json(
+        'zuul-job:%s:%s:%s' % (zuul, tenant, name), job, ZUUL_JOB_TTL)
+
+
+def get_nodes_index(zuul, tenant):
+    return cache_store.get_cache().get_json(
+        'zuul-nodes:%s:%s' % (zuul, tenant))
+
+
+def save_nodes_index(zuul, tenant, index):
+    cache_store.get_cache().put_json(
+        'zuul-nodes:%s:%s' % (zuul, tenant), index, ZUUL_JOB_TTL)
@@ -0,0 +1,114 @@
+import math
+
+# Quantiles are estimated within this relative error.
+RELATIVE_ACCURACY = 0.01
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class DurationStats(object):
+    """Streaming statistics of job durations.
+
+    Besides the count, sum, minimum and maximum, durations are counted in
+    buckets growing exponentially in size, so any quantile is known within
+    RELATIVE_ACCURACY of the real value. Durations of a job are at most a few
+    hours long, so there are never more than some hundreds of buckets, no
+    matter how many durations are added. Stats can be merged, e.g. when they
+    were collected by separate workers or runs.
+    """
+
+    _gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(_gamma)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.zeros = 0
+        self.buckets = {}
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+        if duration <= 0:
+            self.zeros += 1
+            return
+        index = int(math.ceil(math.log(duration) / self._log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is None:
+                continue
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def get_quantile(self, quantile):
+        if not self.count:
+            return None
+        rank = quantile * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # The middle of the bucket, in relative terms.
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'min': self.min,
+                'max': self.max, 'zeros': self.zeros,
+                'buckets': {str(i): c for i, c in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data['count']
+        stats.total = data['total']
+        stats.min = data['min']
+        stats.max = data['max']
+        stats.zeros = data['zeros']
+        stats.buckets = {int(i): c for i, c in data['buckets'].items()}
+        return stats
+
+
+def merge_summaries(summary, other):
+    """Merge stats of every job and week of one summary into another."""
+    for job_name, weeks in other.items():
+        job_summary = summary.setdefault(job_name, {})
+        for week, stats in weeks.items():
+            if week not in job_summary:
+                job_summary[week] = DurationStats()
+            job_summary[week].merge(stats)
+    return summary
+
+
+def summary_to_dict(summary):
+    return {job_name: {week: stats.to_dict()
+                       for week, stats in weeks.items()}
+            for job_name, weeks in summary.items()}
+
+
+def summary_from_dict(data):
+    return {job_name: {week: DurationStats.from_dict(stats)
+                       for week, stats in weeks.items()}
+            for job_name, weeks in data.items()}
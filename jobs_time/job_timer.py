@@ -1,43 +1,84 @@
+import argparse
+import collections
 import json
-import pprint
-import sys
-import requests
+from concurrent import futures
+
+# Imported first, it makes the "common" package importable.
+import jobs_time
+from common import transport
+from common import zuul_report
+import change_cache
 
-HOST = 'https://review.opendev.org'
 ZUUL = 'https://zuul.opendev.org'
+TENANT = 'openstack'
 JOBCACHE = {}
+# Jobs whose definitions couldn't be downloaded.
+FAILED_JOBS = set()
+# Changes which couldn't be downloaded, they are left out of the node time.
+FAILED_CHANGES = set()
+# Number of nodes used by every job, with its parents already resolved.
+# It's loaded from the cache when first needed.
+NODES_INDEX = None
+
+DEFAULT_CONCURRENCY = 8
+# Node time of many changes is summed by each of these.
+NODE_TIME_KINDS = ('job', 'project', 'week')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Summarize how many nodes and how much node time the '
+                    'CI jobs of a change used.')
+    parser.add_argument(
+        'change',
+        nargs='*',
+        help='Change to summarize. With more changes, node time of all of '
+             'them is summed per job, project and week instead.')
+    parser.add_argument(
+        '--query',
+        help='Sum node time of all the changes matching this Gerrit query, '
+             'e.g. "project:openstack/neutron+status:merged+'
+             'after:2021-01-01".')
+    parser.add_argument(
+        '--prefetch-all',
+        action='store_true',
+        help='Download definitions of all the jobs of the Zuul tenant and '
+             'index their numbers of nodes first, so that later runs only '
+             'look them up.')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Number of job definitions, or of changes, downloaded at '
+             'once. Default: %d' % DEFAULT_CONCURRENCY)
+
+    return parser.parse_args()
+
+
+def get_change(change):
+    """Return the change with its messages.
+
+    Messages are cached by the change's revision, which is cheap to ask
+    for.
+    """
+    info = jobs_time.get_gerrit_json(
+        'changes/%s?o=CURRENT_REVISION' % change)
+    messages = change_cache.get_messages(info)
+    if messages is None:
+        messages = jobs_time.get_gerrit_json('changes/%s/messages' % change)
+        change_cache.save_messages(info, messages)
+    info['messages'] = messages
+    return info
+
 
-def get_gerrit_json(path):
-    r = requests.get('%s/%s' % (HOST, path))
-    return json.loads(r.content.split(b'\n', 1)[1])
+def get_change_messages(change):
+    return get_change(change)['messages']
 
 
 def get_latest_zuul_change_comments(change):
-    messages = get_gerrit_json('changes/%s/messages' % change)
-    for message in reversed(messages):
-        if message['author']['username'] == 'zuul' \
-           and ('Verified+1' in message['message'] or \
-                'Verified-1' in message['message']):
-            print('Chose zuul comment from PS %s on change %s' % (
-                message['_revision_number'], change))
-            return message['message']
-
-
-def parse_human_time(timestr):
-    sec = 0
-
-    for piece in timestr.split():
-        suffix = piece[-1]
-        amount = int(piece[:-1])
-        if suffix == 's':
-            sec += amount
-        elif suffix == 'm':
-            sec += 60 * amount
-        elif suffix == 'h':
-            sec += 3600 * amount
-        else:
-            print('Unhandled suffix %s in %s' % (suffix, piece))
-    return sec
+    message, _week = jobs_time.get_latest_zuul_comment(
+        change, get_change_messages(change))
+    return message
 
 
 def make_human_time(sec):
@@ -55,52 +96,114 @@ def make_human_time(sec):
 
 
 def parse_job_info(zuul_msg):
-    jobs = {}
-    last = None
-    for line in zuul_msg.split('\n'):
-        if line.startswith('-'):
-            _dash, job, url, _colon, status, _in, time = (
-                line.split(' ', 6))
-            if '(' in time:
-                time, voting = time.rsplit(' ', 1)
-            else:
-                voting = None
-            jobs[job] = (url, status, parse_human_time(time), voting)
-    return jobs
+    return {result.job: result
+            for result in zuul_report.iter_results(zuul_msg)}
 
 
 def get_zuul_job(jobname):
     global JOBCACHE
     if jobname not in JOBCACHE:
-        r = requests.get('%s/api/tenant/openstack/job/%s' % (
-            ZUUL, jobname))
+        JOBCACHE[jobname] = change_cache.get_zuul_job(ZUUL, TENANT, jobname)
+    if JOBCACHE[jobname] is None:
         try:
-            JOBCACHE[jobname] = r.json()[0]
+            content = transport.get_transport().http_get(
+                '%s/api/tenant/%s/job/%s' % (ZUUL, TENANT, jobname))
+            JOBCACHE[jobname] = json.loads(content)[0]
+            change_cache.save_zuul_job(ZUUL, TENANT, jobname,
+                                       JOBCACHE[jobname])
         except Exception as e:
             print('Failed to fetch or parse job info for %s: %s' % (
                 jobname, e))
+            FAILED_JOBS.add(jobname)
             JOBCACHE[jobname] = {'nodeset': {'nodes': []}}
     return JOBCACHE[jobname]
 
 
+def get_tenant_jobs():
+    content = transport.get_transport().http_get(
+        '%s/api/tenant/%s/jobs' % (ZUUL, TENANT))
+    return [job['name'] for job in json.loads(content)]
+
+
+def prefetch_zuul_jobs(jobnames, concurrency=DEFAULT_CONCURRENCY):
+    """Download definitions of the jobs and of all their parents.
+
+    Definitions are downloaded concurrently, a level of parents at a time.
+    """
+    pending = {jobname for jobname in jobnames if jobname not in JOBCACHE}
+    with futures.ThreadPoolExecutor(concurrency) as executor:
+        while pending:
+            jobdefs = list(executor.map(get_zuul_job, pending))
+            pending = {jobdef['parent'] for jobdef in jobdefs
+                       if 'nodeset' not in jobdef and 'parent' in jobdef}
+            pending.difference_update(JOBCACHE)
+
+
+def get_nodes_index():
+    global NODES_INDEX
+    if NODES_INDEX is None:
+        NODES_INDEX = change_cache.get_nodes_index(ZUUL, TENANT) or {}
+    return NODES_INDEX
+
+
+def index_zuul_nodes(jobnames=None, concurrency=DEFAULT_CONCURRENCY):
+    """Add numbers of nodes of the jobs to the index and cache it.
+
+    By default all the jobs of the tenant are indexed. Only jobs which are
+    not indexed yet are downloaded.
+    """
+    if jobnames is None:
+        jobnames = get_tenant_jobs()
+    index = get_nodes_index()
+    missing = [jobname for jobname in jobnames if jobname not in index]
+    if not missing:
+        return index
+    prefetch_zuul_jobs(missing, concurrency)
+    for jobname in missing:
+        try:
+            get_zuul_nodes(jobname)
+        except Exception as e:
+            print(e)
+    change_cache.save_nodes_index(ZUUL, TENANT, index)
+    return index
+
+
 def get_zuul_nodes(jobname):
+    index = get_nodes_index()
+    if jobname in index:
+        return index[jobname]
+    chain = []
     while True:
+        chain.append(jobname)
         jobdef = get_zuul_job(jobname)
         if 'nodeset' in jobdef:
-            return len(jobdef['nodeset']['nodes'])
+            nodes = len(jobdef['nodeset']['nodes'])
+            break
         if 'parent' not in jobdef:
             raise Exception(
-                '%s has no parent and nodes not found yet' % jobname)
+                '%s has no parent and nodes not found yet' % chain[0])
         jobname = jobdef['parent']
+        if jobname in index:
+            nodes = index[jobname]
+            break
+    if not FAILED_JOBS.intersection(chain):
+        # Every job in the chain inherits the same nodeset.
+        for name in chain:
+            index[name] = nodes
+    return nodes
 
 
-def do_summary(change):
+def do_summary(change, concurrency=DEFAULT_CONCURRENCY):
     msg = get_latest_zuul_change_comments(change)
     jobinfo = parse_job_info(msg)
+    index_zuul_nodes(jobinfo, concurrency)
     total_time = 0
     total_nodes = 0
     for job, info in jobinfo.items():
-        job_time = info[2]
+        if info.seconds is None:
+            print('Job %s did not run: %s' % (job, info.status))
+            continue
+        job_time = info.seconds
         nodes = get_zuul_nodes(job)
         total_nodes += nodes
         print('Job %s takes %i nodes for %s, total %s' % (
@@ -114,5 +217,110 @@ def do_summary(change):
     print('Total nodes is %i' % total_nodes)
 
 
+def _try_get_change(change):
+    try:
+        return get_change(change)
+    except (transport.TransportError, ValueError) as e:
+        print('Failed to fetch change %s: %s' % (change, e))
+        FAILED_CHANGES.add(change)
+        return None
+
+
+def get_changes(changes, concurrency=DEFAULT_CONCURRENCY):
+    """Yield the changes with their messages, downloaded concurrently.
+
+    Changes which can't be downloaded, e.g. which don't exist, are skipped
+    and added to FAILED_CHANGES.
+    """
+    with futures.ThreadPoolExecutor(concurrency) as executor:
+        for change in executor.map(_try_get_change, changes):
+            if change is not None:
+                yield change
+
+
+def get_node_time(changes, concurrency=DEFAULT_CONCURRENCY):
+    """Sum node time of the jobs in the latest Zuul reports of the changes.
+
+    Returns Counters of runs, node seconds and leaked runs and seconds for
+    every job, project and week. Time of jobs whose number of nodes is not
+    known is leaked, it isn't part of the node time.
+    """
+    reports = []
+    for change in changes:
+        message, week = jobs_time.get_latest_zuul_comment(
+            change['_number'], change['messages'])
+        if message:
+            reports.append((change.get('project'), week, message))
+    results = [zuul_report.parse_report(report) for _, _, report in reports]
+    # Nodes of all the jobs are resolved at once, before they are summed.
+    index_zuul_nodes({result.job for job_results in results
+                      for result in job_results}, concurrency)
+
+    totals = {kind: collections.defaultdict(collections.Counter)
+              for kind in NODE_TIME_KINDS}
+    for (project, week, _report), job_results in zip(reports, results):
+        for result in job_results:
+            if result.seconds is None:
+                continue
+            try:
+                nodes = get_zuul_nodes(result.job)
+            except Exception as e:
+                print(e)
+                nodes = 0
+            for kind, key in (('job', result.job), ('project', project),
+                              ('week', week)):
+                counter = totals[kind][key]
+                counter['runs'] += 1
+                if nodes:
+                    counter['node_seconds'] += nodes * result.seconds
+                else:
+                    counter['leaked_runs'] += 1
+                    counter['leaked_seconds'] += result.seconds
+    return totals
+
+
+def print_node_time(totals):
+    for kind in NODE_TIME_KINDS:
+        if kind == 'week':
+            keys = sorted(totals[kind], key=jobs_time.get_week_start)
+        else:
+            keys = sorted(totals[kind],
+                          key=lambda key: totals[kind][key]['node_seconds'],
+                          reverse=True)
+        print('%s,Runs,Node hours,Leaked runs,Leaked hours' %
+              kind.capitalize())
+        for key in keys:
+            counter = totals[kind][key]
+            print('%s,%s,%.1f,%s,%.1f' % (
+                key, counter['runs'], counter['node_seconds'] / 3600.0,
+                counter['leaked_runs'], counter['leaked_seconds'] / 3600.0))
+        print('')
+
+    leaked = sorted(job for job, counter in totals['job'].items()
+                    if counter['leaked_runs'])
+    total = sum(totals['job'].values(), collections.Counter())
+    print('Total node time %s' % make_human_time(total['node_seconds']))
+    if leaked:
+        print('No job info for %i jobs, leaked time %s! %s' % (
+            len(leaked), make_human_time(total['leaked_seconds']),
+            ', '.join(leaked)))
+
+
 if __name__ == '__main__':
-    do_summary(sys.argv[1])
+    args = get_parser()
+    if args.prefetch_all:
+        index = index_zuul_nodes(concurrency=args.concurrency)
+        print('Indexed numbers of nodes of %s jobs' % len(index))
+    if args.query or len(args.change) > 1:
+        if args.query:
+            changes = jobs_time.iter_changes(
+                '/changes/?q=%s' % args.query, concurrency=args.concurrency,
+                use_cache=True)
+        else:
+            changes = get_changes(args.change, args.concurrency)
+        print_node_time(get_node_time(changes, args.concurrency))
+        if FAILED_CHANGES:
+            print('Failed to fetch %i changes, they are not counted: %s' % (
+                len(FAILED_CHANGES), ', '.join(sorted(FAILED_CHANGES))))
+    elif args.change:
+        do_summary(args.change[0], args.concurrency)
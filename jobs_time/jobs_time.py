@@ -3,14 +3,26 @@
 import argparse
 import collections
 import datetime
+import functools
 import json
 import os
 import re
-import requests
-import subprocess
 import sys
+from concurrent import futures
 
-import matplotlib.pyplot as plt
+# jobs_time.py and job_timer.py are run from this directory, which doesn't
+# have the "common" package. job_timer.py imports this module before it.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+
+from common import charts  # noqa: E402
+from common import transport  # noqa: E402
+from common import zuul_report  # noqa: E402
+import change_cache  # noqa: E402
+import job_stats  # noqa: E402
+import regressions  # noqa: E402
+import shards  # noqa: E402
+import zuul_builds  # noqa: E402
 
 # Script based on Assaf Muller's script
 # https://github.com/assafmuller/gerrit_time_to_merge/blob/master/time_to_merge.py
@@ -19,13 +31,33 @@ import matplotlib.pyplot as plt
 
 HOST = 'https://review.opendev.org'
 
+SOURCES = ('gerrit', 'zuul')
+
+DEFAULT_CONCURRENCY = 8
+# Number of changes in every page of the results. Each change comes with
+# all its messages, so pages are kept smaller than Gerrit's own limit.
+DEFAULT_PAGE_SIZE = 100
+# Only messages are needed, and detailed accounts for the usernames of
+# their authors.
+CHANGE_OPTIONS = '&o=MESSAGES&o=DETAILED_ACCOUNTS'
+# With the cache, changes are listed only with their revisions first, and
+# messages are then downloaded only for the changes which aren't cached.
+LIST_OPTIONS = '&o=CURRENT_REVISION'
+
 
 def get_parser():
     parser = argparse.ArgumentParser(
         description='Take from gerrit list of changes merged in a given '
                     'time period.')
-    parser.add_argument('start')
-    parser.add_argument('end')
+    parser.add_argument(
+        'start',
+        type=get_time_arg,
+        help='Start of the time period, a Gerrit TIME in UTC like '
+             '"2021-06-01" or "2021-06-01 12:00:00".')
+    parser.add_argument(
+        'end',
+        type=get_time_arg,
+        help='End of the time period, in the same format.')
     parser.add_argument(
         '--verbose',
         action='store_true',
@@ -45,31 +77,205 @@ def get_parser():
         '--job-name-regex',
         default=None,
         help='Regex of the name of the job(s) which will be displayed')
+    parser.add_argument(
+        '--source',
+        default='gerrit',
+        choices=SOURCES,
+        help='Where times of the jobs come from: "gerrit" (default) parses '
+             'the last Zuul comment on every change, "zuul" asks the Zuul '
+             'builds API for all builds, with their exact times.')
+    parser.add_argument(
+        '--pipeline',
+        default='check',
+        help='With "--source zuul", only use builds run in this pipeline. '
+             'Default: check')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Number of shards of the time period crawled at once. '
+             'Default: %d' % DEFAULT_CONCURRENCY)
+    parser.add_argument(
+        '--shard-days',
+        type=int,
+        default=shards.DEFAULT_SHARD_DAYS,
+        help='Split the time period into shards of this many days, crawled '
+             'at once, up to --concurrency of them. Default: %d' %
+             shards.DEFAULT_SHARD_DAYS)
+    parser.add_argument(
+        '--progress-file',
+        default=None,
+        help='Save the results of every finished shard to this file. If '
+             'the run is interrupted, running it again with the same '
+             'arguments only crawls the shards which are missing.')
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help='Number of changes, with their comments, asked for in every '
+             'request. Default: %d' % DEFAULT_PAGE_SIZE)
+    parser.add_argument(
+        '--max-rate',
+        type=float,
+        default=None,
+        help='Send at most this many requests to Gerrit per second. '
+             'Failed requests are retried with backoff either way.')
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Don't use comments of changes cached by earlier runs, and "
+             "don't cache them. Comments of merged and abandoned changes "
+             "are cached otherwise, see TOOLS_CACHE_DIR in README.rst.")
+    parser.add_argument(
+        '--print-stats',
+        action='store_true',
+        help='Print statistics of the time of every job in every week: '
+             'number of runs, mean, median, 90th and 99th percentile, '
+             'minimum and maximum, in CSV format.')
+    parser.add_argument(
+        '--regressions',
+        action='store_true',
+        help='Instead of plotting, print jobs whose median time shifted '
+             'significantly at some week, the most significant first.')
+    parser.add_argument(
+        '--min-shift',
+        type=float,
+        default=regressions.DEFAULT_MIN_SHIFT * 100,
+        help='With --regressions, only report shifts changing the time of '
+             'the job by at least this many percent. Default: %d' %
+             (regressions.DEFAULT_MIN_SHIFT * 100))
+    parser.add_argument(
+        '--min-weeks',
+        type=int,
+        default=regressions.DEFAULT_MIN_WEEKS,
+        help='With --regressions, number of weeks with runs needed both '
+             'before and after a shift. Default: %d' %
+             regressions.DEFAULT_MIN_WEEKS)
+    parser.add_argument(
+        '--export-charts',
+        default=None,
+        metavar='DIR',
+        help='Instead of showing the chart, render it to a file in this '
+             'directory, together with a chart for every job, which also '
+             'shows percentiles of its time. No display is needed, charts '
+             'are rendered in parallel.')
+    parser.add_argument(
+        '--chart-format',
+        default='png',
+        choices=charts.FORMATS,
+        help='File format of the exported charts. Default: png')
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='Number of processes rendering the exported charts. '
+             'Default: number of CPUs')
+    parser.add_argument(
+        '--transport',
+        default=None,
+        choices=transport.MODES,
+        help='How Gerrit is accessed: "live" (default), "record" to also '
+             'save every response in the fixtures directory, or "replay" to '
+             'serve saved responses without accessing the network.')
+    parser.add_argument(
+        '--fixtures-dir',
+        default=None,
+        help='Directory of the responses saved or served by the "record" '
+             'and "replay" transports. Default: %s' %
+             transport.DEFAULT_FIXTURES_DIR)
 
     return parser.parse_args()
 
 
-def get_gerrit_json(path):
-    r = requests.get('%s/%s' % (HOST, path))
-    return json.loads(r.content.split(b'\n', 1)[1])
+def get_time_arg(value):
+    try:
+        shards.parse_time(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
 
 
-def get_changes(query):
-    changes = []
-    start = 0
-    patches = get_gerrit_json(query)
+def _get_time_term(value):
+    # Times with a time of day have a space, so they are quoted.
+    if ' ' in value:
+        return '%%22%s%%22' % value.replace(' ', '+')
+    return value
 
-    changes = [p['_number'] for p in patches]
 
-    if not changes:
-        print('No patches found!')
-        sys.exit(1)
+def get_query(start, end, branch, project=None, status=None):
+    query = ("/changes/?q=branch:%(branch)s+"
+             "after:%(start)s+before:%(end)s" % {
+                'branch': branch, 'start': _get_time_term(start),
+                'end': _get_time_term(end)})
+    if project:
+        query += "+project:%s" % project
+    if status:
+        query += "+is:%s" % status
+    return query
+
+
+def get_gerrit_json(path):
+    content = transport.get_transport().http_get('%s/%s' % (HOST, path))
+    return json.loads(content.split(b'\n', 1)[1])
+
 
+def get_changes_page(query, start, page_size=DEFAULT_PAGE_SIZE,
+                     use_cache=False):
+    if not use_cache:
+        return get_gerrit_json('%s%s&n=%d&S=%d' % (
+            query, CHANGE_OPTIONS, page_size, start))
+
+    changes = get_gerrit_json('%s%s&n=%d&S=%d' % (
+        query, LIST_OPTIONS, page_size, start))
+    missing = {}
+    for change in changes:
+        messages = change_cache.get_messages(change)
+        if messages is None:
+            missing[change['_number']] = change
+        else:
+            change['messages'] = messages
+    if missing:
+        # Messages of all the changes which aren't cached are downloaded
+        # with a single query.
+        for change in get_gerrit_json('/changes/?q=%s%s&n=%d' % (
+                '+OR+'.join('change:%s' % number for number in missing),
+                CHANGE_OPTIONS, len(missing))):
+            listed = missing[change['_number']]
+            listed['messages'] = change.get('messages', [])
+            change_cache.save_messages(listed, listed['messages'])
     return changes
 
 
-def get_latest_zuul_change_comments(change):
-    messages = get_gerrit_json('changes/%s/messages' % change)
+def iter_changes(query, page_size=DEFAULT_PAGE_SIZE, concurrency=1,
+                 use_cache=False):
+    """Yield changes matching the query, with their messages.
+
+    Results are read page by page, for as long as Gerrit says there are
+    more of them. After the first page, ``concurrency`` pages are asked for
+    at once; the pages after the last one just come back empty. With
+    ``use_cache`` messages are downloaded only for changes which were not
+    seen before.
+    """
+    fetch_page = functools.partial(get_changes_page, query,
+                                   page_size=page_size, use_cache=use_cache)
+    found = 0
+    start = 0
+    pages = 1
+    with futures.ThreadPoolExecutor(concurrency) as executor:
+        while True:
+            starts = [start + i * page_size for i in range(pages)]
+            for changes in executor.map(fetch_page, starts):
+                found += len(changes)
+                print("Found %s changes so far" % found)
+                for change in changes:
+                    yield change
+                if not changes or not changes[-1].get('_more_changes'):
+                    return
+            start = starts[-1] + page_size
+            pages = concurrency
+
+
+def get_latest_zuul_comment(change, messages):
     for message in reversed(messages):
         if message.get('author', {}).get('username') == 'zuul' \
            and ('Verified+1' in message.get('message') or \
@@ -89,90 +295,179 @@ def get_comment_week(message):
     return "%s-%s" % (year, week)
 
 
-def parse_human_time(timestr):
-    sec = 0
-    for piece in timestr.split():
-        suffix = piece[-1]
-        amount = int(piece[:-1])
-        if suffix == 's':
-            sec += amount
-        elif suffix == 'm':
-            sec += 60 * amount
-        elif suffix == 'h':
-            sec += 3600 * amount
-        else:
-            print('Unhandled suffix %s in %s' % (suffix, piece))
-    return sec
-
-
 def parse_job_info(zuul_msg):
-    jobs = {}
-    last = None
-    for line in zuul_msg.split('\n'):
-        if line.startswith('-'):
-            _dash, job, url, _colon, status, _in, time = (
-                line.split(' ', 6))
-            if '(' in time:
-                time, voting = time.rsplit(' ', 1)
-            else:
-                voting = None
-            jobs[job] = (url, status, parse_human_time(time), voting)
-    return jobs
+    return {result.job: result
+            for result in zuul_report.iter_results(zuul_msg)}
 
 
 def get_summary(changes, job_name_pattern=None):
+    """Summarize times of the jobs from changes with their messages.
+
+    Returns DurationStats of every job in every week.
+    """
     job_name_re = None
     if job_name_pattern:
         job_name_re = re.compile(job_name_pattern)
     summary = {}
     for change in changes:
-        msg, week = get_latest_zuul_change_comments(change)
+        number = change['_number']
+        msg, week = get_latest_zuul_comment(number,
+                                            change.get('messages', []))
         if not msg or not week:
-            print("No Zuul data found for change %s. Skipping it." % change)
+            print("No Zuul data found for change %s. Skipping it." % number)
             continue
         jobinfo = parse_job_info(msg)
         for job_name, info in jobinfo.items():
+            if info.seconds is None:
+                # The job didn't run, e.g. it was skipped.
+                continue
             if not job_name_re or job_name_re.match(job_name):
-                job_time = info[2]
+                job_time = info.seconds
                 if job_name not in summary:
-                    summary[job_name] = collections.defaultdict(list)
-                summary[job_name][week].append(job_time)
+                    summary[job_name] = collections.defaultdict(
+                        job_stats.DurationStats)
+                summary[job_name][week].add(job_time)
     return summary
 
 
-def plot_jobs(job_data):
-    plt.xlabel('year-week of the comment')
-    plt.ylabel('avg job time [seconds]')
+def get_week_start(week):
+    year, week = week.split('-')
+    return datetime.date.fromisocalendar(int(year), int(week), 1)
+
+
+def get_jobs_chart(jobs_data, path=None, title=None, quantiles=()):
+    series = []
+    for job_name, job_data in sorted(jobs_data.items()):
+        weeks = sorted(job_data, key=get_week_start)
+        x = [get_week_start(week) for week in weeks]
+        series.append({'label': 'Average time of the job %s' % job_name,
+                       'x': x,
+                       'y': [job_data[week].mean for week in weeks]})
+        for quantile in quantiles:
+            series.append({
+                'label': '%sth percentile of the job %s' % (
+                    int(quantile * 100), job_name),
+                'x': x,
+                'y': [job_data[week].get_quantile(quantile)
+                      for week in weeks]})
+    return {'path': path,
+            'title': title,
+            'xlabel': 'week of the comment',
+            'ylabel': 'avg job time [seconds]',
+            'series': series}
 
-    for job_name, job_data in jobs_data.items():
-        x_values = []
-        y_values = []
-        points = []
-        for week, values in job_data.items():
-            x = week
-            y = sum(values) / len(values)
-            points.append((x, y))
-        points = sorted(points, key=lambda x: x[0])
-        x_values = [p[0] for p in points]
-        y_values = [p[1] for p in points]
-        plt.plot(x_values, y_values,
-                 label='Average time of the job %s' % job_name)
-    plt.legend()
-    plt.show()
+
+def print_stats(jobs_data):
+    print('Job,Week,Runs,Mean,%s,Min,Max' % ','.join(
+        'p%d' % (quantile * 100) for quantile in job_stats.QUANTILES))
+    for job_name, job_data in sorted(jobs_data.items()):
+        for week in sorted(job_data, key=get_week_start):
+            stats = job_data[week]
+            print('%s,%s,%s,%.1f,%s,%s,%s' % (
+                job_name, week, stats.count, stats.mean,
+                ','.join('%.0f' % stats.get_quantile(quantile)
+                         for quantile in job_stats.QUANTILES),
+                stats.min, stats.max))
+
+
+def get_weeks(jobs_data):
+    return sorted({week for job_data in jobs_data.values()
+                   for week in job_data}, key=get_week_start)
+
+
+def print_regressions(jobs_data, min_shift, min_weeks):
+    shifts = regressions.get_regressions(
+        jobs_data, get_weeks(jobs_data), min_shift=min_shift / 100,
+        min_weeks=min_weeks)
+    if not shifts:
+        print('No significant shifts of job times found.')
+        return
+    print('%-60s %-8s %10s %10s %8s %6s' % (
+        'Job', 'Week', 'Before [s]', 'After [s]', 'Shift', 'Score'))
+    for shift in shifts:
+        print('%-60s %-8s %10.0f %10.0f %+7.1f%% %6.1f' % (
+            shift.job, shift.week, shift.before, shift.after,
+            shift.relative_shift * 100, shift.score))
+
+
+def plot_jobs(jobs_data):
+    charts.show_chart(get_jobs_chart(jobs_data))
+
+
+def export_jobs_charts(jobs_data, directory, chart_format, processes=None):
+    # One chart with all the jobs and one more for every job.
+    specs = [get_jobs_chart(
+        jobs_data, charts.get_chart_path(directory, 'jobs', chart_format))]
+    for job_name, job_data in sorted(jobs_data.items()):
+        specs.append(get_jobs_chart(
+            {job_name: job_data},
+            charts.get_chart_path(directory, 'job-%s' % job_name,
+                                  chart_format),
+            title=job_name, quantiles=job_stats.QUANTILES))
+    for path in charts.export_charts(specs, processes):
+        print("Chart saved to %s" % path)
 
 
 if __name__ == '__main__':
     args = get_parser()
-    query = ("/changes/?q=branch:%(branch)s+"
-             "after:%(start)s+before:%(end)s" % {
-                'branch': args.branch, 'start': args.start, 'end': args.end})
-    if args.project:
-        query += "+project:%s" % args.project
-    if args.status:
-        query += "+is:%s" % args.status
-
-    print("Query: %s" % query)
-    changes = get_changes(query)
-    print("Found %s changes matching requested condition." % len(changes))
-    jobs_data = get_summary(changes, args.job_name_regex)
-    plot_jobs(jobs_data)
+    transport.configure(args.transport, args.fixtures_dir,
+                        pool_size=max(args.concurrency,
+                                      transport.DEFAULT_POOL_SIZE),
+                        max_rate=args.max_rate)
+    if args.source == 'zuul':
+        # Builds can't be asked for by time, only listed from the newest,
+        # so they are crawled in one go.
+        shards_list = [(args.start, args.end)]
+        run = {'source': 'zuul', 'project': args.project,
+               'branch': args.branch, 'pipeline': args.pipeline}
+
+        def summarize(start, end):
+            builds = zuul_builds.iter_builds(
+                shards.parse_time(start), shards.parse_time(end),
+                project=args.project, branch=args.branch,
+                pipeline=args.pipeline)
+            return zuul_builds.get_summary(builds, args.job_name_regex)
+    else:
+        shards_list = shards.get_shards(args.start, args.end,
+                                        args.shard_days)
+        query = get_query(args.start, args.end, args.branch, args.project,
+                          args.status)
+        print("Query: %s" % query)
+        run = {'source': 'gerrit', 'query': query,
+               'shard_days': args.shard_days}
+
+        def summarize(start, end):
+            # Shards are crawled at once, their pages one by one.
+            changes = iter_changes(
+                get_query(start, end, args.branch, args.project,
+                          args.status),
+                args.page_size, use_cache=not args.no_cache)
+            return get_summary(changes, args.job_name_regex)
+    run['job_name_regex'] = args.job_name_regex
+
+    try:
+        progress = shards.Progress(args.progress_file, run)
+    except shards.ProgressError as e:
+        print(e)
+        sys.exit(1)
+    jobs_data, failed = shards.crawl(shards_list, summarize, progress,
+                                     args.concurrency)
+    if failed:
+        print("%d of %d shards failed" % (len(failed), len(shards_list)))
+        if args.progress_file:
+            print("Run again with the same --progress-file to crawl only "
+                  "them")
+        sys.exit(1)
+    if not jobs_data:
+        print('No Zuul data found!')
+        sys.exit(1)
+    if args.regressions:
+        print_regressions(jobs_data, args.min_shift, args.min_weeks)
+        sys.exit(0)
+    if args.print_stats:
+        print_stats(jobs_data)
+    if args.export_charts:
+        export_jobs_charts(jobs_data, args.export_charts, args.chart_format,
+                           args.processes)
+    elif not args.print_stats:
+        plot_jobs(jobs_data)
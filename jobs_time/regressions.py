@@ -0,0 +1,108 @@
+import collections
+
+import numpy as np
+
+
+# A shift has to be this many times bigger than the noise around it.
+DEFAULT_MIN_SCORE = 4.0
+# ... and change the time of the job by at least this part.
+DEFAULT_MIN_SHIFT = 0.1
+# Weeks needed on both sides of a shift.
+DEFAULT_MIN_WEEKS = 3
+
+Shift = collections.namedtuple(
+    'Shift', ['job', 'week', 'before', 'after', 'shift', 'relative_shift',
+              'score'])
+
+
+def get_duration_matrix(summary, weeks, quantile=0.5):
+    """Return jobs and a matrix of their times, one row per job.
+
+    Every column is one of the weeks, in the given order. The time of a job
+    in a week is its given quantile, the median by default, which isn't
+    moved by a few runs stuck until a timeout. Weeks without runs are NaN.
+    """
+    jobs = sorted(summary)
+    week_index = {week: i for i, week in enumerate(weeks)}
+    matrix = np.full((len(jobs), len(weeks)), np.nan)
+    for row, job in enumerate(jobs):
+        for week, stats in summary[job].items():
+            matrix[row, week_index[week]] = stats.get_quantile(quantile)
+    return jobs, matrix
+
+
+def find_shifts(matrix, min_weeks=DEFAULT_MIN_WEEKS):
+    """Find the most likely step in every row of the matrix.
+
+    Every split of a row into weeks before and after it is scored at once
+    for all the rows, from cumulative sums: the score is the difference of
+    the means of both parts divided by its standard error. Returns, for
+    every row, the index of the first week after the best split, the means
+    before and after it and its score; rows with too few weeks get a score
+    of 0.
+    """
+    jobs_count, weeks_count = matrix.shape
+    if weeks_count < 2:
+        empty = np.zeros(jobs_count)
+        return np.ones(jobs_count, dtype=np.int64), empty, empty, empty
+    present = ~np.isnan(matrix)
+    values = np.where(present, matrix, 0.0)
+
+    def cumulative(array):
+        # Sums of the first k weeks, for k from 1 to weeks_count - 1.
+        return np.cumsum(array, axis=1)[:, :-1]
+
+    count_before = cumulative(present.astype(np.float64))
+    sum_before = cumulative(values)
+    squares_before = cumulative(values ** 2)
+    count_after = present.sum(axis=1, keepdims=True) - count_before
+    sum_after = values.sum(axis=1, keepdims=True) - sum_before
+    squares_after = (values ** 2).sum(axis=1, keepdims=True) - squares_before
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_before = sum_before / count_before
+        mean_after = sum_after / count_after
+        # Pooled variance of both parts around their own means.
+        residuals = (squares_before - count_before * mean_before ** 2 +
+                     squares_after - count_after * mean_after ** 2)
+        variance = residuals / (count_before + count_after - 2)
+        # The noise is never assumed to be less than 1% of the time, so
+        # perfectly flat series don't give infinite scores.
+        floor = (0.01 * (sum_before + sum_after) /
+                 (count_before + count_after)) ** 2
+        variance = np.maximum(variance, floor)
+        error = np.sqrt(variance * (1 / count_before + 1 / count_after))
+        scores = np.abs(mean_after - mean_before) / error
+    valid = (count_before >= min_weeks) & (count_after >= min_weeks)
+    scores = np.where(valid & np.isfinite(scores), scores, 0.0)
+
+    best = np.argmax(scores, axis=1)
+    rows = np.arange(jobs_count)
+    return (best + 1, mean_before[rows, best], mean_after[rows, best],
+            scores[rows, best])
+
+
+def get_regressions(summary, weeks, min_score=DEFAULT_MIN_SCORE,
+                    min_shift=DEFAULT_MIN_SHIFT, min_weeks=DEFAULT_MIN_WEEKS):
+    """Return significant shifts of the times of jobs, surest first.
+
+    Weeks are given in their order in time. Both jobs getting slower and
+    faster are returned, with the first week after the shift.
+    """
+    jobs, matrix = get_duration_matrix(summary, weeks)
+    if not jobs:
+        return []
+    splits, before, after, scores = find_shifts(matrix, min_weeks)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = (after - before) / before
+    significant = np.nonzero(
+        (scores >= min_score) & (np.abs(relative) >= min_shift))[0]
+    shifts = []
+    for i in significant:
+        # The split may be followed by weeks without runs, the shift is
+        # reported at the first week with some.
+        split = splits[i] + int(np.argmax(~np.isnan(matrix[i, splits[i]:])))
+        shifts.append(Shift(jobs[i], weeks[split], float(before[i]),
+                            float(after[i]), float(after[i] - before[i]),
+                            float(relative[i]), float(scores[i])))
+    return sorted(shifts, key=lambda s: s.score, reverse=True)
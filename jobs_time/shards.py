@@ -0,0 +1,151 @@
+import datetime
+import json
+import os
+import threading
+from concurrent import futures
+
+import job_stats
+
+DEFAULT_SHARD_DAYS = 7
+# Gerrit TIME values without a time zone, which default to UTC.
+TIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%d %H:%M:%S.%f')
+# Gerrit keeps times to the millisecond.
+TIME_RESOLUTION = datetime.timedelta(milliseconds=1)
+
+
+def parse_time(value):
+    """Parse a Gerrit TIME value, like "2021-06-01" or "2021-06-01 12:00".
+
+    Raises ValueError for other formats, including times with a zone.
+    """
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValueError('"%s" is not a time in UTC like "2021-06-01" or '
+                     '"2021-06-01 12:00:00[.000]"' % value)
+
+
+def format_time(value):
+    """Format a time as the shortest Gerrit TIME value."""
+    if value.microsecond:
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    if value.time() != datetime.time():
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value.strftime('%Y-%m-%d')
+
+
+def get_shards(start, end, days=DEFAULT_SHARD_DAYS):
+    """Split the range between two times into ranges of ``days`` days.
+
+    Returns (start, end) tuples of Gerrit TIME values, the last range ends
+    at ``end`` and may be shorter. Gerrit's after: and before: are both
+    inclusive, so every range ends right before the next one starts and no
+    change is counted in two of them.
+    """
+    shard_start = parse_time(start)
+    last = parse_time(end)
+    shards = []
+    while shard_start < last:
+        next_start = min(shard_start + datetime.timedelta(days=days), last)
+        if next_start < last:
+            shard_end = format_time(next_start - TIME_RESOLUTION)
+        else:
+            shard_end = end
+        shards.append((format_time(shard_start) if shards else start,
+                       shard_end))
+        shard_start = next_start
+    return shards or [(start, end)]
+
+
+def _get_shard_key(shard):
+    return '%s..%s' % shard
+
+
+class ProgressError(Exception):
+    pass
+
+
+class Progress(object):
+    """Summaries of the finished shards of a run, checkpointed to a file.
+
+    The file is written again, atomically, after every finished shard, so a
+    run which was interrupted can be resumed from it. It belongs to a
+    single run, described by ``run``, e.g. its query; reading the file of
+    another run raises ProgressError. Without a path nothing is saved.
+    """
+
+    def __init__(self, path, run):
+        self.path = path
+        self.run = run
+        self.shards = {}
+        self._lock = threading.Lock()
+        if not path or not os.path.exists(path):
+            return
+        with open(path) as progress_file:
+            data = json.load(progress_file)
+        if data.get('run') != run:
+            raise ProgressError(
+                'Progress file %s was written by another run: %s' % (
+                    path, data.get('run')))
+        self.shards = data['shards']
+
+    def get_summary(self, shard):
+        """Return the summary of a finished shard, or None."""
+        data = self.shards.get(_get_shard_key(shard))
+        if data is None:
+            return None
+        return job_stats.summary_from_dict(data)
+
+    def save(self, shard, summary):
+        with self._lock:
+            self.shards[_get_shard_key(shard)] = job_stats.summary_to_dict(
+                summary)
+            if not self.path:
+                return
+            tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+            with open(tmp_path, 'w') as progress_file:
+                json.dump({'run': self.run, 'shards': self.shards},
+                          progress_file)
+            os.replace(tmp_path, self.path)
+
+
+def crawl(shards, summarize, progress, concurrency=1):
+    """Summarize all the shards which aren't finished yet, and merge them.
+
+    ``summarize`` is called with the start and end of a shard and returns
+    its summary, for ``concurrency`` shards at once. Every summary is saved
+    to ``progress`` as soon as it is ready. A failed shard doesn't stop the
+    others; returns the summary of all the finished shards and the list of
+    the failed ones.
+    """
+    summary = {}
+    pending = []
+    for shard in shards:
+        shard_summary = progress.get_summary(shard)
+        if shard_summary is None:
+            pending.append(shard)
+        else:
+            job_stats.merge_summaries(summary, shard_summary)
+    if len(pending) < len(shards):
+        print("Resuming, %d of %d shards are already done" % (
+            len(shards) - len(pending), len(shards)))
+
+    failed = []
+    with futures.ThreadPoolExecutor(concurrency) as executor:
+        running = {executor.submit(summarize, *shard): shard
+                   for shard in pending}
+        for future in futures.as_completed(running):
+            shard = running[future]
+            try:
+                shard_summary = future.result()
+            except Exception as e:
+                print("Shard %s - %s failed: %s" % (shard[0], shard[1], e))
+                failed.append(shard)
+                continue
+            progress.save(shard, shard_summary)
+            job_stats.merge_summaries(summary, shard_summary)
+            print("Shard %s - %s done" % shard)
+    return summary, sorted(failed)
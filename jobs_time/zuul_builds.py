@@ -0,0 +1,86 @@
+import collections
+import datetime
+import json
+import re
+
+from common import transport
+import job_stats
+
+
+ZUUL = 'https://zuul.opendev.org'
+TENANT = 'openstack'
+
+# Builds are returned newest first, this many in every page.
+DEFAULT_PAGE_SIZE = 500
+
+
+def parse_time(value):
+    # 2021-06-10T15:15:00, sometimes with fractions of a second.
+    return datetime.datetime.fromisoformat(value.split('.')[0])
+
+
+def get_builds_page(params, skip, page_size=DEFAULT_PAGE_SIZE):
+    params = dict(params, skip=skip, limit=page_size)
+    content = transport.get_transport().http_get(
+        '%s/api/tenant/%s/builds' % (ZUUL, TENANT), params)
+    return json.loads(content)
+
+
+def iter_builds(start, end, project=None, branch=None, job_name=None,
+                pipeline=None, page_size=DEFAULT_PAGE_SIZE):
+    """Yield finished builds which started between start and end.
+
+    Builds are asked for by the given filters, page by page, until builds
+    started before ``start`` are reached; the API can't filter them by
+    time itself.
+    """
+    params = {'complete': 'true'}
+    for name, value in (('project', project), ('branch', branch),
+                        ('job_name', job_name), ('pipeline', pipeline)):
+        if value:
+            params[name] = value
+    skip = 0
+    while True:
+        builds = get_builds_page(params, skip, page_size)
+        for build in builds:
+            if not build.get('start_time'):
+                continue
+            started = parse_time(build['start_time'])
+            if started < start:
+                return
+            if started < end:
+                yield build
+        if len(builds) < page_size:
+            return
+        skip += len(builds)
+        print("Found %s builds so far" % skip)
+
+
+def get_build_duration(build):
+    if build.get('duration') is not None:
+        return build['duration']
+    if build.get('end_time'):
+        return (parse_time(build['end_time']) -
+                parse_time(build['start_time'])).total_seconds()
+    return None
+
+
+def get_summary(builds, job_name_pattern=None):
+    """Summarize exact times of the builds, like jobs_time.get_summary."""
+    job_name_re = None
+    if job_name_pattern:
+        job_name_re = re.compile(job_name_pattern)
+    summary = {}
+    for build in builds:
+        job_name = build['job_name']
+        if job_name_re and not job_name_re.match(job_name):
+            continue
+        duration = get_build_duration(build)
+        if duration is None:
+            continue
+        year, week, _ = parse_time(build['start_time']).isocalendar()
+        if job_name not in summary:
+            summary[job_name] = collections.defaultdict(
+                job_stats.DurationStats)
+        summary[job_name]['%s-%s' % (year, week)].add(duration)
+    return summary
@@ -1,41 +1,23 @@
 #!/bin/env python
 
-import csv
-import collections
 import sys
 
 from prettytable import PrettyTable
 
+import survey
+
 PROJECT_NAME = "Project"
 PRODUCTION = "Production"
 TESTING = "Testing"
 INTERESTED = "Interested"
 
 
-def get_data_in_lists(csv_file):
-    # This returns data in list of lists in format like:
-    # [['Project', 'Answear', 'Answear', ... ],
-    #  ['Question 2', 'Answear', 'Answear', ... ]]
-
-    result_data = []
-    with open(csv_file) as data:
-        raw_data = list(csv.reader(data, delimiter=',', quotechar='"'))
-        result_data = [[question] for question in raw_data[0]]
-        for row in raw_data[1:]:
-            for i, element in enumerate(row):
-                if element:
-                    result_data[i].append(element)
-    return result_data
-
-
 def get_projects_data(data):
-    projects = {}
-    for row in data:
-        project_name = row[0]
-        projects[project_name] = collections.defaultdict(int)
-        for response in row[1:]:
-            projects[project_name][response] += 1
-    return projects
+    # Every question is about one project.
+    categories = [PRODUCTION, TESTING, INTERESTED]
+    counts = data.get_counts(data.questions, categories)
+    return {question: dict(zip(categories, row))
+            for question, row in zip(data.questions, counts.tolist())}
 
 
 def print_data(data):
@@ -58,6 +40,5 @@ def print_data(data):
 
 if __name__ == '__main__':
     csv_file = sys.argv[1]
-    data_lists = get_data_in_lists(csv_file)
-    projects_data_dict = get_projects_data(data_lists)
+    projects_data_dict = get_projects_data(survey.Survey.load(csv_file))
     print_data(projects_data_dict)
@@ -0,0 +1,148 @@
+import collections
+import datetime
+
+import numpy as np
+
+
+TIME_WINDOWS = ('day', 'week', 'month', 'quarter', 'year')
+
+SECONDS_PER_DAY = 86400
+EPOCH = datetime.date(1970, 1, 1)
+
+BucketStats = collections.namedtuple(
+    'BucketStats', ['mean', 'median', 'p90', 'count'])
+
+
+def _get_bucket_keys(merged, time_window):
+    # Every bucket is identified by an integer: days, Monday of the week
+    # (in days), months, quarters or years since the epoch.
+    days = merged // SECONDS_PER_DAY
+    if time_window == 'day':
+        return days
+    if time_window == 'week':
+        # 1970-01-01 was a Thursday.
+        return days - (days + 3) % 7
+    months = merged.astype('datetime64[s]').astype('datetime64[M]').astype(
+        np.int64)
+    if time_window == 'month':
+        return months
+    if time_window == 'quarter':
+        return months // 3
+    return months // 12
+
+
+def _get_bucket_start(key, time_window):
+    if time_window in ('day', 'week'):
+        return EPOCH + datetime.timedelta(days=int(key))
+    months = {'month': 1, 'quarter': 3, 'year': 12}[time_window] * int(key)
+    return datetime.date(1970 + months // 12, months % 12 + 1, 1)
+
+
+def _get_bucket_label(key, time_window):
+    start = _get_bucket_start(key, time_window)
+    if time_window == 'day':
+        return start.isoformat()
+    if time_window == 'week':
+        year, week, _ = start.isocalendar()
+        return "%s-%s" % (year, week)
+    if time_window == 'month':
+        return "%s-%s" % (start.year, start.month)
+    if time_window == 'quarter':
+        return "%s-Q%s" % (start.year, (start.month - 1) // 3 + 1)
+    return start.year
+
+
+def _get_bucket_end(key, time_window):
+    end = _get_bucket_start(key + 1, time_window)
+    return (end - EPOCH).days * SECONDS_PER_DAY
+
+
+def _get_sorted_quantile(values, starts, counts, quantile):
+    # Linear interpolation between the closest ranks, like numpy.percentile,
+    # computed for all groups of an already sorted array at once.
+    position = starts + quantile * (counts - 1)
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+class PointsAggregator(object):
+    """Statistics of build failures grouped by the time patches merged.
+
+    Points are held as arrays and results are memoized for each requested
+    window, so several reports can be made from one set of points without
+    computing anything twice.
+    """
+
+    def __init__(self, points):
+        merged = np.fromiter((p['merged'] for p in points),
+                             dtype=np.int64, count=len(points))
+        build_failures = np.fromiter((p['build_failures'] for p in points),
+                                     dtype=np.float64, count=len(points))
+        order = np.argsort(merged, kind='stable')
+        self.merged = merged[order]
+        self.build_failures = build_failures[order]
+        self._results = {}
+
+    def get_stats(self, time_window, rolling_days=None):
+        """Return an ordered dict of bucket label to BucketStats.
+
+        With ``rolling_days``, the stats of every bucket are computed over
+        the points merged in that many days up to the end of the bucket.
+        """
+        if time_window not in TIME_WINDOWS:
+            raise ValueError('Unknown time window %s' % time_window)
+        key = (time_window, rolling_days)
+        if key not in self._results:
+            if rolling_days:
+                stats = self._get_rolling_stats(time_window, rolling_days)
+            else:
+                stats = self._get_bucket_stats(time_window)
+            self._results[key] = stats
+        return self._results[key]
+
+    def get_means(self, time_window, rolling_days=None):
+        return collections.OrderedDict(
+            (label, stats.mean) for label, stats in
+            self.get_stats(time_window, rolling_days).items())
+
+    def _get_bucket_stats(self, time_window):
+        if not len(self.merged):
+            return collections.OrderedDict()
+        keys = _get_bucket_keys(self.merged, time_window)
+        # Sort by bucket and then by value, so every bucket is a sorted,
+        # contiguous slice of the values.
+        order = np.lexsort((self.build_failures, keys))
+        keys = keys[order]
+        values = self.build_failures[order]
+        bucket_keys, starts, counts = np.unique(
+            keys, return_index=True, return_counts=True)
+        sums = np.add.reduceat(values, starts)
+        means = sums / counts
+        medians = _get_sorted_quantile(values, starts, counts, 0.5)
+        p90s = _get_sorted_quantile(values, starts, counts, 0.9)
+        return collections.OrderedDict(
+            (_get_bucket_label(bucket_key, time_window),
+             BucketStats(float(means[i]), float(medians[i]),
+                         float(p90s[i]), int(counts[i])))
+            for i, bucket_key in enumerate(bucket_keys))
+
+    def _get_rolling_stats(self, time_window, rolling_days):
+        result = collections.OrderedDict()
+        if not len(self.merged):
+            return result
+        bucket_keys = np.unique(_get_bucket_keys(self.merged, time_window))
+        ends = np.array([_get_bucket_end(bucket_key, time_window)
+                         for bucket_key in bucket_keys], dtype=np.int64)
+        lows = np.searchsorted(
+            self.merged, ends - rolling_days * SECONDS_PER_DAY, side='left')
+        highs = np.searchsorted(self.merged, ends, side='left')
+        for bucket_key, low, high in zip(bucket_keys, lows, highs):
+            window = self.build_failures[low:high]
+            if not len(window):
+                continue
+            median, p90 = np.percentile(window, [50, 90])
+            result[_get_bucket_label(bucket_key, time_window)] = BucketStats(
+                float(window.mean()), float(median), float(p90),
+                int(len(window)))
+        return result
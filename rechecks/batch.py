@@ -0,0 +1,92 @@
+import collections
+import sys
+from concurrent import futures
+
+import numpy as np
+
+from common import cache_store
+from common import transport
+import aggregate
+import recheck_points
+
+
+BatchResult = collections.namedtuple(
+    'BatchResult',
+    ['project', 'branch', 'patches', 'build_failures', 'average', 'median',
+     'p90'])
+
+
+def read_projects(path):
+    # One project per line, like in the output of tc_make_repos_list.py.
+    # "-" reads the list from the standard input.
+    if path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(path) as projects_file:
+            lines = projects_file.readlines()
+    return [line.strip() for line in lines
+            if line.strip() and not line.startswith('#')]
+
+
+def _get_result(project, branch, build_failures):
+    if not len(build_failures):
+        return BatchResult(project, branch, 0, 0, None, None, None)
+    median, p90 = np.percentile(build_failures, [50, 90])
+    return BatchResult(
+        project, branch, len(build_failures), int(build_failures.sum()),
+        float(build_failures.mean()), float(median), float(p90))
+
+
+def _collect(job):
+    project, branch, options, time_windows, rolling_days = job
+    query = recheck_points.get_query(
+        branch, project, options.get('newer_than'))
+    # Projects are already handled in parallel, so patches of each one are
+    # classified in the worker process itself.
+    points = recheck_points.get_points(query, processes=1, **options)
+    build_failures = np.array([p['build_failures'] for p in points])
+    aggregator = aggregate.PointsAggregator(points)
+    series = {time_window: aggregator.get_means(time_window, rolling_days)
+              for time_window in time_windows}
+    result = _get_result(project, branch, build_failures)
+    return result, build_failures, series
+
+
+def _configure(settings):
+    # Workers may be spawned rather than forked, so they don't inherit what
+    # the main process configured.
+    transport.configure(settings.get('transport'),
+                        settings.get('fixtures_dir'))
+    cache_store.configure(settings.get('cache_dir'),
+                          settings.get('cache_max_size'))
+
+
+def run_batch(projects, branches, processes, options, time_windows=(),
+              rolling_days=None, settings=None):
+    """Collect recheck statistics for every project and branch pair.
+
+    Pairs are handled by a pool of worker processes, which all share the
+    same cache. Returns the results of every pair, the overall totals and,
+    for every pair, the average number of rechecks in each of the requested
+    time windows. ``settings`` are the transport and cache options the
+    workers are configured with: transport, fixtures_dir, cache_dir and
+    cache_max_size.
+    """
+    jobs = [(project, branch, options, time_windows, rolling_days)
+            for project in projects for branch in branches]
+    results = []
+    all_build_failures = []
+    all_series = collections.OrderedDict()
+    with futures.ProcessPoolExecutor(
+            processes, initializer=_configure,
+            initargs=(settings or {},)) as executor:
+        for result, build_failures, series in executor.map(_collect, jobs):
+            results.append(result)
+            all_build_failures.append(build_failures)
+            all_series[(result.project, result.branch)] = series
+    if all_build_failures:
+        all_build_failures = np.concatenate(all_build_failures)
+    else:
+        all_build_failures = np.array([])
+    totals = _get_result('TOTAL', '', all_build_failures)
+    return results, totals, all_series
@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import time
+
+from common import cache_store
+import gerrit_query
+
+
+LOG = logging.getLogger(__name__)
+
+# Changes used to be kept in files in this directory, relative to where the
+# script was run. They are still read from there if they're not cached yet.
+LEGACY_STORE_DIR = 'cache'
+
+# Changes updated this many seconds before the last sync are asked for again,
+# so that clock skew between us and Gerrit can't make us miss anything.
+SYNC_OVERLAP = 3600
+
+# Every save appends a segment with the changes merged since the last one;
+# when there are this many, the store is written again as a single segment.
+MAX_SEGMENTS = 16
+
+
+def _get_file_from_query(query):
+    return query.replace('/', '_')
+
+
+class ChangeStore(object):
+    """Local copy of the changes returned by a single Gerrit query.
+
+    Besides the changes themselves, the store remembers the newest
+    ``lastUpdated`` timestamp it has seen, so it can be brought up to date
+    by asking Gerrit only for changes updated after that point.
+
+    The changes are cached in segments listed by a small manifest. Saving
+    the store only writes the changes merged since it was loaded, as a new
+    segment, so bringing it up to date doesn't rewrite all of it; loading
+    merges the segments in order.
+    """
+
+    def __init__(self, query, cache=None, ttl=None):
+        self.query = query
+        self.ttl = ttl
+        self.key = 'gerrit-changes:%s' % query
+        self.version_key = 'gerrit-changes-version:%s' % query
+        self.cache = cache or cache_store.get_cache()
+        self._reset()
+
+    def _reset(self):
+        self.changes = {}
+        self.last_updated = None
+        # Changes with the points computed from them, which are only valid
+        # for this exact version of the store.
+        self.version = None
+        self.segments = []
+        # Changes last updated before this were pruned, even if they are
+        # still in older segments.
+        self.older_than = None
+        # Changes merged since the store was loaded or saved.
+        self._new = {}
+        self._pruned = False
+        # Whether the changes of the segments are loaded, or only the
+        # manifest.
+        self._complete = True
+
+    def _load_legacy(self):
+        path = os.path.join(LEGACY_STORE_DIR, _get_file_from_query(self.query))
+        if not os.path.exists(path):
+            return None
+        LOG.debug('Importing changes from %s', path)
+        with open(path) as store_file:
+            return json.load(store_file)
+
+    def _get_segment_key(self, segment):
+        return '%s:%s' % (self.key, segment)
+
+    def load(self, changes=True):
+        """Load the store, or only its manifest if ``changes`` is false.
+
+        Changes merged into a store loaded without its changes can still be
+        saved.
+        """
+        content = self.cache.get_json(self.key)
+        if content is None:
+            content = self._load_legacy()
+            if content is None:
+                return
+        if isinstance(content, list):
+            # Cache file written by the old, whole-query cache.
+            self.merge(content)
+            self.save()
+            return
+        if 'changes' in content:
+            # Written before the store was split into segments, it's written
+            # whole again when it's saved.
+            self.merge(content['changes'])
+            self._new = {}
+        self.last_updated = content['last_updated']
+        self.version = content.get('version')
+        self.segments = content.get('segments', [])
+        self.older_than = content.get('older_than')
+        self._complete = False
+        if changes:
+            self._load_segments()
+
+    def _load_segments(self):
+        """Merge the changes of all the segments.
+
+        Returns False if any of them was evicted from the cache; the store
+        is then dropped, so that it's downloaded again.
+        """
+        new = self._new
+        self._new = {}
+        for segment in self.segments:
+            changes = self.cache.get_json(self._get_segment_key(segment))
+            if changes is None:
+                LOG.debug('Segment %s of the store is missing', segment)
+                self.cache.delete(self.key)
+                self.cache.delete(self.version_key)
+                self._reset()
+                return False
+            self.merge(change for change in changes
+                       if self.older_than is None or
+                       change['lastUpdated'] >= self.older_than)
+        # Changes merged before the segments were loaded are newer.
+        self.merge(new.values())
+        self._new = new
+        self._complete = True
+        return True
+
+    def save(self):
+        if self.segments and not self._new and not self._pruned:
+            return
+        old_segments = []
+        if not self.segments or len(self.segments) >= MAX_SEGMENTS:
+            if not self._complete and not self._load_segments():
+                return
+            old_segments = self.segments
+            self.segments = []
+            changes = self.changes
+        else:
+            changes = self._new
+        self.version = '%s-%s' % (time.time_ns(), os.getpid())
+        if changes or not self.segments:
+            self.cache.put_json(self._get_segment_key(self.version),
+                                list(changes.values()), self.ttl)
+            self.segments.append(self.version)
+        self.cache.put_json(self.key,
+                            {'last_updated': self.last_updated,
+                             'version': self.version,
+                             'older_than': self.older_than,
+                             'segments': self.segments},
+                            self.ttl)
+        # The version is also kept on its own, so it can be checked without
+        # loading the manifest.
+        self.cache.put(self.version_key, self.version.encode('utf-8'),
+                       self.ttl)
+        for segment in old_segments:
+            self.cache.delete(self._get_segment_key(segment))
+        self._new = {}
+        self._pruned = False
+
+    def load_version(self):
+        version = self.cache.get(self.version_key)
+        self.version = version.decode('utf-8') if version else None
+        return self.version
+
+    def merge(self, changes):
+        new = 0
+        merged = 0
+        for change in changes:
+            merged += 1
+            known = self.changes.get(change['id'])
+            if known is None:
+                new += 1
+            elif known['lastUpdated'] > change['lastUpdated']:
+                continue
+            self.changes[change['id']] = change
+            self._new[change['id']] = change
+            if (self.last_updated is None or
+                    change['lastUpdated'] > self.last_updated):
+                self.last_updated = change['lastUpdated']
+        LOG.debug('Merged %s changes into the store, %s of them new',
+                  merged, new)
+        return new
+
+    def prune(self, older_than):
+        self.older_than = max(older_than, self.older_than or older_than)
+        self._pruned = True
+        self.changes = {
+            change_id: change for change_id, change in self.changes.items()
+            if change['lastUpdated'] >= self.older_than}
+        self._new = {
+            change_id: change for change_id, change in self._new.items()
+            if change['lastUpdated'] >= self.older_than}
+
+    def get_delta_query(self, now=None):
+        now = time.time() if now is None else now
+        age = int(now - self.last_updated) + SYNC_OVERLAP
+        return gerrit_query.append_query_term(self.query, '-age:%ds' % age)
+
+    def get_changes(self):
+        return sorted(self.changes.values(), key=lambda x: x['createdOn'])
@@ -0,0 +1,175 @@
+import functools
+import json
+import logging
+from concurrent import futures
+
+from common import transport
+
+
+LOG = logging.getLogger(__name__)
+
+GERRIT_HOST = 'review.opendev.org'
+GERRIT_PORT = '29418'
+
+DEFAULT_SLICE_DAYS = 90
+
+
+def append_query_term(query, term):
+    # Terms starting with "-" would be taken by "gerrit query" as its own
+    # options unless they are placed after "--".
+    query = query.rstrip()
+    if term.startswith('-') and '--' not in query.split():
+        query += ' --'
+    return '%s %s' % (query, term)
+
+
+def _get_slice_query(query, start_days, end_days):
+    # age:N matches changes updated more than N days ago, so each slice
+    # takes the changes last updated in [start_days, end_days) days ago.
+    if start_days:
+        query = append_query_term(query, 'age:%dd' % start_days)
+    return append_query_term(query, '-age:%dd' % end_days)
+
+
+def iter_page(query, start=0, stats=None):
+    """Yield changes of a single result page as ssh outputs them.
+
+    The statistics line closing the page is stored in ``stats``. Raises
+    transport.TransportError if the query fails.
+    """
+    gerrit_cmd = [
+        'gerrit', 'query', '--format=json', '--current-patch-set',
+        '--comments', '--start', str(start), query]
+    for line in transport.get_transport().ssh_lines(
+            GERRIT_HOST, GERRIT_PORT, gerrit_cmd):
+        row = json.loads(line)
+        if row.get('type') == 'stats':
+            if stats is not None:
+                stats.update(row)
+            continue
+        yield row
+
+
+def query_page(query, start=0):
+    stats = {}
+    changes = list(iter_page(query, start, stats))
+    return changes, stats.get('moreChanges', False)
+
+
+def iter_changes(query):
+    start = 0
+
+    while True:
+        stats = {}
+        count = 0
+        for change in iter_page(query, start, stats):
+            count += 1
+            yield change
+        start += count
+        LOG.debug('Found metadata for %s more patches, %s total so far '
+                  '(query: %s)', count, start, query)
+        if not stats.get('moreChanges') or not count:
+            break
+
+
+def fetch_pages(query, transform=None):
+    if transform is None:
+        return list(iter_changes(query))
+    return [transform(change) for change in iter_changes(query)]
+
+
+def has_changes(query):
+    changes, _more_changes = query_page(
+        append_query_term(query, 'limit:1'))
+    return bool(changes)
+
+
+def fetch_changes(query, workers=1, slice_days=DEFAULT_SLICE_DAYS,
+                  newer_than=None, transform=None):
+    """Fetch all changes matching the query.
+
+    With more than one worker the query is split into disjoint slices of
+    ``slice_days`` days of the changes' last update, and the slices are
+    paginated concurrently. When ``newer_than``
+    (in days) isn't given, slices are taken going back in time for as long
+    as Gerrit still has older changes matching the query.
+
+    If ``transform`` is given, it is applied to every change as soon as it
+    is parsed and only its results are kept. They must have the change's
+    ``id`` for de-duplication.
+    """
+    if workers <= 1:
+        return fetch_pages(query, transform)
+    merged = {}
+    for changes in _iter_slices(query, workers, slice_days, newer_than,
+                                transform):
+        _merge_changes(merged, changes)
+    return list(merged.values())
+
+
+def iter_fetched_changes(query, workers=1, slice_days=DEFAULT_SLICE_DAYS,
+                         newer_than=None, transform=None):
+    """Yield changes matching the query as soon as they are fetched.
+
+    Like fetch_changes(), but with one worker every change is yielded as
+    soon as it's read, and with more workers the changes of every slice
+    as soon as the slice is done, so they are never all held at once.
+    A change updated while the slices are fetched may be found in two of
+    them; only the first one found is yielded, so the ids of the changes
+    are kept.
+    """
+    if workers <= 1:
+        for change in iter_changes(query):
+            yield transform(change) if transform else change
+        return
+    seen = set()
+    for changes in _iter_slices(query, workers, slice_days, newer_than,
+                                transform):
+        for change in changes:
+            if change['id'] not in seen:
+                seen.add(change['id'])
+                yield change
+
+
+def _iter_slices(query, workers, slice_days, newer_than, transform):
+    fetch = functools.partial(fetch_pages, transform=transform)
+    if newer_than:
+        return _iter_bounded_slices(
+            query, fetch, workers, slice_days, newer_than)
+    return _iter_unbounded_slices(query, fetch, workers, slice_days)
+
+
+def _merge_changes(merged, changes):
+    for change in changes:
+        known = merged.get(change['id'])
+        if (known is None or
+                known.get('lastUpdated', 0) <= change.get('lastUpdated', 0)):
+            merged[change['id']] = change
+
+
+def _iter_bounded_slices(query, fetch, workers, slice_days, newer_than):
+    slices = [
+        _get_slice_query(query, start, min(start + slice_days, newer_than))
+        for start in range(0, newer_than, slice_days)]
+    with futures.ThreadPoolExecutor(workers) as executor:
+        for changes in executor.map(fetch, slices):
+            yield changes
+
+
+def _iter_unbounded_slices(query, fetch, workers, slice_days):
+    offset = 0
+    # One extra worker checks whether there's anything older than the
+    # round of slices which is being fetched.
+    with futures.ThreadPoolExecutor(workers + 1) as executor:
+        while True:
+            round_end = offset + workers * slice_days
+            older = executor.submit(
+                has_changes, append_query_term(query, 'age:%dd' % round_end))
+            slices = [
+                _get_slice_query(query, start, start + slice_days)
+                for start in range(offset, round_end, slice_days)]
+            for changes in executor.map(fetch, slices):
+                yield changes
+            if not older.result():
+                break
+            offset = round_end
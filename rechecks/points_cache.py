@@ -0,0 +1,171 @@
+import array
+import io
+import logging
+import struct
+
+
+LOG = logging.getLogger(__name__)
+
+# Points are kept in the cache next to the changes they were computed from,
+# as columns: merged timestamps, build failures and the lastUpdated
+# timestamps of the changes as packed integers, projects
+# as indexes into a table of distinct names, and the remaining strings as
+# newline separated blobs. Per-job tallies are a list of (job, failures,
+# successes) entries, with the offsets of the entries of every point.
+# Reading them back needs neither JSON decoding nor parsing of the comments
+# again.
+MAGIC = b'RCHKPTS3'
+HEADER = struct.Struct('<8sI')
+LENGTH = struct.Struct('<Q')
+
+
+def _get_key(query):
+    return 'recheck-points:%s' % query
+
+
+def _write_blob(points_file, blob):
+    points_file.write(LENGTH.pack(len(blob)))
+    points_file.write(blob)
+
+
+def _read_blob(points_file):
+    length, = LENGTH.unpack(points_file.read(LENGTH.size))
+    return points_file.read(length)
+
+
+def _write_strings(points_file, strings):
+    _write_blob(points_file, '\n'.join(strings).encode('utf-8'))
+
+
+def _read_strings(points_file, count):
+    if not count:
+        _read_blob(points_file)
+        return []
+    return _read_blob(points_file).decode('utf-8').split('\n')
+
+
+def _write_array(points_file, typecode, values):
+    _write_blob(points_file, array.array(typecode, values).tobytes())
+
+
+def _read_array(points_file, typecode):
+    values = array.array(typecode)
+    values.frombytes(_read_blob(points_file))
+    return values
+
+
+def save_points(cache, query, parser_version, store_version, points,
+                updates, ttl=None):
+    """Cache points of the query.
+
+    ``updates`` are the lastUpdated timestamps of the changes the points
+    were made of. Points are only loaded again by the same version of the
+    parser. All of them together are the points of the given version of
+    the change store, and every one of them stays valid on its own as long
+    as its change isn't updated.
+    """
+    projects = sorted({point['project'] for point in points})
+    project_index = {project: i for i, project in enumerate(projects)}
+
+    points_file = io.BytesIO()
+    points_file.write(HEADER.pack(MAGIC, len(points)))
+    _write_blob(points_file, str(parser_version).encode('utf-8'))
+    _write_blob(points_file, store_version.encode('utf-8'))
+    _write_array(points_file, 'q', updates)
+    _write_array(points_file, 'q', (p['merged'] for p in points))
+    _write_array(points_file, 'l', (p['build_failures'] for p in points))
+    _write_strings(points_file, projects)
+    _write_array(points_file, 'L',
+                 (project_index[p['project']] for p in points))
+    for field in ('id', 'url', 'subject'):
+        _write_strings(points_file,
+                       (p[field].replace('\n', ' ') for p in points))
+    _write_job_tallies(points_file, points)
+    cache.put(_get_key(query), points_file.getvalue(), ttl)
+
+
+def _get_point_jobs(point):
+    return set(point['job_failures']) | set(point['job_successes'])
+
+
+def _write_job_tallies(points_file, points):
+    jobs = sorted({job for p in points for job in _get_point_jobs(p)})
+    job_index = {job: i for i, job in enumerate(jobs)}
+    offsets = [0]
+    indexes = []
+    failures = []
+    successes = []
+    for point in points:
+        for job in _get_point_jobs(point):
+            indexes.append(job_index[job])
+            failures.append(point['job_failures'].get(job, 0))
+            successes.append(point['job_successes'].get(job, 0))
+        offsets.append(len(indexes))
+    _write_strings(points_file, jobs)
+    _write_array(points_file, 'Q', offsets)
+    _write_array(points_file, 'L', indexes)
+    _write_array(points_file, 'L', failures)
+    _write_array(points_file, 'L', successes)
+
+
+def _read_job_tallies(points_file, count):
+    jobs = _read_strings(points_file, count)
+    offsets = _read_array(points_file, 'Q')
+    indexes = _read_array(points_file, 'L')
+    failures = _read_array(points_file, 'L')
+    successes = _read_array(points_file, 'L')
+    tallies = []
+    for i in range(count):
+        job_failures = {}
+        job_successes = {}
+        for entry in range(offsets[i], offsets[i + 1]):
+            job = jobs[indexes[entry]]
+            if failures[entry]:
+                job_failures[job] = failures[entry]
+            if successes[entry]:
+                job_successes[job] = successes[entry]
+        tallies.append((job_failures, job_successes))
+    return tallies
+
+
+def load_points(cache, query, parser_version):
+    """Return the cached points of the query, or None.
+
+    Returns the version of the change store they were made of, the points
+    and the lastUpdated timestamps of their changes.
+    """
+    content = cache.get(_get_key(query))
+    if content is None:
+        return None
+
+    with io.BytesIO(content) as points_file:
+        magic, count = HEADER.unpack(points_file.read(HEADER.size))
+        if magic != MAGIC:
+            LOG.debug('Cached points of %s are not valid', query)
+            return None
+        if (_read_blob(points_file).decode('utf-8') !=
+                str(parser_version)):
+            LOG.debug('Cached points of %s are outdated', query)
+            return None
+        store_version = _read_blob(points_file).decode('utf-8')
+        updates = _read_array(points_file, 'q')
+        merged = _read_array(points_file, 'q')
+        build_failures = _read_array(points_file, 'l')
+        projects = _read_strings(points_file, count)
+        project_indexes = _read_array(points_file, 'L')
+        ids = _read_strings(points_file, count)
+        urls = _read_strings(points_file, count)
+        subjects = _read_strings(points_file, count)
+        job_tallies = _read_job_tallies(points_file, count)
+
+    LOG.debug('Loaded %s cached points of %s', count, query)
+    points = [{'id': ids[i],
+               'merged': merged[i],
+               'build_failures': build_failures[i],
+               'project': projects[project_indexes[i]],
+               'url': urls[i],
+               'subject': subjects[i],
+               'job_failures': job_tallies[i][0],
+               'job_successes': job_tallies[i][1]}
+              for i in range(count)]
+    return store_version, points, list(updates)
@@ -0,0 +1,269 @@
+import collections
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent import futures
+
+from common import zuul_report
+import change_store
+import gerrit_query
+import points_cache
+
+
+LOG = logging.getLogger(__name__)
+
+# Must be increased whenever get_point_from_patch starts giving different
+# results, so that points cached by an older version are not used anymore.
+PARSER_VERSION = 3
+
+BUILD_FAILED_REGEX = re.compile(r"Build failed \((check|gate) pipeline\)")
+PS_REGEX = re.compile(r"Patch Set (\d+)\:")
+
+# Job results which don't mean the job failed.
+NOT_FAILED_STATUSES = ('SUCCESS', 'SKIPPED')
+
+# Patches are classified in chunks of this size by a pool of processes.
+CHUNK_SIZE = 500
+
+_CHUNK_DATA = None
+
+
+def get_query(branch, project=None, newer_than=None):
+    query = "status:merged branch:%s " % branch
+    if project:
+        query += 'project:%s ' % project
+    if newer_than:
+        query += ' -- -age:%dd' % int(newer_than)
+    return query
+
+
+def get_submission_timestamp(patch):
+    try:
+        # Not all patches have approvals data
+        approvals = patch['currentPatchSet']['approvals']
+    except KeyError:
+        return patch['lastUpdated']
+
+    # Weirdly enough some patches don't have submission data.
+    # Take lastUpdated instead.
+    return next(
+        (approval['grantedOn'] for approval in approvals if
+         approval['type'] == 'SUBM'), patch['lastUpdated'])
+
+
+def get_point_from_patch(patch):
+    last_ps = int(patch['currentPatchSet']['number'])
+    build_failures = 0
+    job_failures = {}
+    job_successes = {}
+    for comment in patch['comments']:
+        if comment['reviewer']['name'].lower() != 'zuul':
+            continue
+        msg = comment['message']
+        re_ps = PS_REGEX.search(msg)
+        if not re_ps:
+            LOG.debug("No patch set found for comment: %s", msg)
+            continue
+        if int(re_ps.group(1)) != last_ps:
+            LOG.debug("Comment was not for last patch set. Skipping")
+            continue
+
+        failed = bool(BUILD_FAILED_REGEX.search(msg))
+        if failed:
+            build_failures += 1
+
+        for job_result in zuul_report.iter_results(msg, re_ps.end()):
+            job, status = job_result.job, job_result.status
+            if status == 'SUCCESS':
+                job_successes[job] = job_successes.get(job, 0) + 1
+            elif (failed and job_result.voting and
+                    status not in NOT_FAILED_STATUSES):
+                # Only failures of voting jobs made the build fail and
+                # required a recheck.
+                job_failures[job] = job_failures.get(job, 0) + 1
+
+    return {'id': patch['id'],
+            'merged': get_submission_timestamp(patch),
+            'build_failures': build_failures,
+            'project': patch['project'],
+            'url': patch['url'],
+            'subject': patch['subject'],
+            'job_failures': job_failures,
+            'job_successes': job_successes}
+
+
+def get_job_failures(points):
+    """Rank jobs by the number of rechecks they caused.
+
+    Returns a list of (job, failures, successes) tuples, jobs which failed
+    most often first.
+    """
+    failures = collections.Counter()
+    successes = collections.Counter()
+    for point in points:
+        failures.update(point['job_failures'])
+        successes.update(point['job_successes'])
+    jobs = set(failures) | set(successes)
+    return sorted(((job, failures[job], successes[job]) for job in jobs),
+                  key=lambda x: (-x[1], x[0]))
+
+
+def _classify_chunk(bounds):
+    # Forked workers inherit the data, so only chunk bounds are sent to them.
+    start, end = bounds
+    return [get_point_from_patch(patch) for patch in _CHUNK_DATA[start:end]]
+
+
+def _classify_patches(patches):
+    return [get_point_from_patch(patch) for patch in patches]
+
+
+def get_points_from_data(data, processes=None, chunk_size=CHUNK_SIZE):
+    global _CHUNK_DATA
+
+    processes = processes or os.cpu_count() or 1
+    if processes <= 1 or len(data) < 2 * chunk_size:
+        points = _classify_patches(data)
+        return sorted(points, key=lambda i: i['merged'])
+
+    bounds = [(start, min(start + chunk_size, len(data)))
+              for start in range(0, len(data), chunk_size)]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _CHUNK_DATA = data
+        context = multiprocessing.get_context('fork')
+        try:
+            with futures.ProcessPoolExecutor(
+                    processes, mp_context=context) as executor:
+                chunks = list(executor.map(_classify_chunk, bounds))
+        finally:
+            _CHUNK_DATA = None
+    else:
+        with futures.ProcessPoolExecutor(processes) as executor:
+            chunks = list(executor.map(
+                _classify_patches,
+                (data[start:end] for start, end in bounds)))
+    points = [point for chunk in chunks for point in chunk]
+    return sorted(points, key=lambda i: i['merged'])
+
+
+def _update_points(known, changes, processes=None):
+    """Classify the changes whose points aren't known yet.
+
+    ``known`` maps ids of changes to the lastUpdated timestamp of the change
+    a point was made of and the point, it's updated in place.
+    """
+    stale = [change for change in changes
+             if change['id'] not in known or
+             known[change['id']][0] != change['lastUpdated']]
+    LOG.debug("Classifying %s changes", len(stale))
+    updates = {change['id']: change['lastUpdated'] for change in stale}
+    for point in get_points_from_data(stale, processes):
+        known[point['id']] = (updates[point['id']], point)
+
+
+def _save_points(store, known, ttl=None):
+    entries = sorted(known.values(), key=lambda entry: entry[1]['merged'])
+    points = [point for _updated, point in entries]
+    points_cache.save_points(store.cache, store.query, PARSER_VERSION,
+                             store.version, points,
+                             [updated for updated, _point in entries], ttl)
+    return points
+
+
+def _refresh_store(store, newer_than=None):
+    """Merge changes updated since the store was saved, and save it.
+
+    Returns the changes which were merged, if the store was loaded without
+    its changes.
+    """
+    delta_query = store.get_delta_query()
+    LOG.debug("Delta query: %s", delta_query)
+    store.merge(gerrit_query.fetch_changes(delta_query))
+    if newer_than:
+        store.prune(time.time() - newer_than * 86400)
+    changes = list(store.changes.values())
+    store.save()
+    return changes
+
+
+def iter_points(query, workers=1, slice_days=gerrit_query.DEFAULT_SLICE_DAYS,
+                newer_than=None):
+    """Yield recheck points of the patches as they are read from Gerrit.
+
+    Nothing is cached and the points aren't sorted, so neither the patches
+    nor the points are ever all held in memory.
+    """
+    newer_than = int(newer_than) if newer_than else None
+    return gerrit_query.iter_fetched_changes(
+        query, workers=workers, slice_days=slice_days, newer_than=newer_than,
+        transform=get_point_from_patch)
+
+
+def get_points(query, no_cache=False, refresh=False, workers=1,
+               slice_days=gerrit_query.DEFAULT_SLICE_DAYS, newer_than=None,
+               processes=None, cache_ttl=None):
+    """Return recheck points of the patches matching the query.
+
+    Points are served from the cache when possible. Otherwise the query
+    results are downloaded, or only brought up to date when ``refresh`` is
+    set, and stored together with the points made of them. Only changes
+    updated since their points were cached are classified, by
+    ``processes`` worker processes. With
+    ``no_cache`` every patch is reduced to its point as soon as it's read
+    from Gerrit, so the comments are never all held in memory at once.
+    Cached results expire after ``cache_ttl`` seconds, if it's given.
+    """
+    newer_than = int(newer_than) if newer_than else None
+    if no_cache:
+        points = gerrit_query.fetch_changes(
+            query, workers=workers, slice_days=slice_days,
+            newer_than=newer_than, transform=get_point_from_patch)
+        return sorted(points, key=lambda i: i['merged'])
+
+    store = change_store.ChangeStore(query, ttl=cache_ttl)
+    version = store.load_version()
+    cached = points_cache.load_points(store.cache, query, PARSER_VERSION)
+    known = {}
+    if cached is not None:
+        points_version, points, updates = cached
+        if version is not None and points_version == version:
+            if not refresh:
+                return points
+        else:
+            version = None
+        known = {point['id']: (updated, point)
+                 for point, updated in zip(points, updates)}
+
+    if refresh and version is not None:
+        # The cached points are those of all the changes in the store, so
+        # only the changes updated since have to be read and classified.
+        store.load(changes=False)
+        changes = _refresh_store(store, newer_than)
+        if store.version is not None:
+            _update_points(known, changes, processes)
+            if store.older_than is not None:
+                known = {change_id: entry
+                         for change_id, entry in known.items()
+                         if entry[0] >= store.older_than}
+            return _save_points(store, known, cache_ttl)
+        # Part of the store was evicted from the cache, so it was dropped
+        # and is downloaded again.
+
+    store.load()
+    if not store.changes:
+        store.merge(gerrit_query.fetch_changes(
+            query, workers=workers, slice_days=slice_days,
+            newer_than=newer_than))
+        if not store.changes:
+            return []
+        store.save()
+    elif refresh:
+        _refresh_store(store, newer_than)
+    # Points of changes which weren't updated since they were cached are
+    # still valid, even if the store was written again.
+    known = {change_id: known[change_id] for change_id in store.changes
+             if change_id in known}
+    _update_points(known, store.changes.values(), processes)
+    return _save_points(store, known, cache_ttl)
@@ -1,58 +1,88 @@
 #!/usr/bin/env python3
 
 import argparse
+import csv
 import datetime
+import heapq
+import itertools
 import json
+import logging
 import os
-import re
-import subprocess
 import sys
 
-import matplotlib.pyplot as plt
 from prettytable import PrettyTable
 
+# rechecks.py is the entry point of the tool, so the directory above it,
+# with the "common" package, is added to the path here.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+
+from common import cache_store  # noqa: E402
+from common import charts  # noqa: E402
+from common import transport  # noqa: E402
+import aggregate  # noqa: E402
+import batch  # noqa: E402
+import gerrit_query  # noqa: E402
+import recheck_points  # noqa: E402
+
 
 # Script based on Assaf Muller's script
 # https://github.com/assafmuller/gerrit_time_to_merge/blob/master/time_to_merge.py
 
+PATCH_FIELDS = ['Subject', 'URL', 'Project', 'Rechecks']
+REPORT_FORMATS = ('human', 'csv', 'jsonl')
+STREAMING_FORMATS = ('csv', 'jsonl')
+# The human readable table is built in memory, so it's only used for the
+# patches with the most rechecks.
+DEFAULT_HUMAN_TOP = 100
+
 
 def log_debug(msg):
     if args.verbose:
         print(msg)
 
 
-def exec_cmd(command):
-    process = subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    output, error = process.communicate()
-
-    return output, error
-
-
 def get_parser():
     parser = argparse.ArgumentParser(
         description='Get from gerrit informations about how many builds failed '
                     'on patches before it was finally merged.'
                     'Note that the app uses a caching system - Query results '
-                    'are stored in the cache dir with no timeout. Subsequent '
+                    'are stored in the cache dir, with no timeout unless '
+                    '"--cache-ttl" is given. Subsequent '
                     'runs of the app against the same project and time '
                     'will not query Gerrit, but will use the local results. '
-                    'As the cache has no timeout, its contents '
-                    'must be deleted manually to get a fresh query.')
+                    'Use "--refresh" to fetch only the changes updated since '
+                    'the last run and merge them into the local results.')
     parser.add_argument(
         '--newer-than',
         help='Only look at patches merged in the last so and so days.')
     parser.add_argument(
         '--time-window',
         default='week',
-        help='Count average number of recheck per "week" (default), "month" '
-             'or "year".')
+        choices=aggregate.TIME_WINDOWS,
+        help='Count average number of recheck per "day", "week" (default), '
+             '"month", "quarter" or "year".')
+    parser.add_argument(
+        '--rolling-days',
+        type=int,
+        default=None,
+        help='If this is set, statistics for each time window are computed '
+             'over patches merged in this many days up to the end of the '
+             'window, instead of only those merged in the window.')
     parser.add_argument(
         '--all-patches',
         action='store_true',
         help='If this is set, number of rechecks for each patch separately is '
              'returned. Please note that when this is flag is used, '
              '"--time-window" option has no effect.')
+    parser.add_argument(
+        '--jobs-report',
+        action='store_true',
+        help='If this is set, jobs are ranked by the number of rechecks '
+             'they caused, i.e. by how many times they failed in a build '
+             'which failed on the last patch set of a patch. '
+             'Options like "--all-patches", "--plot" and "--time-window" '
+             'have no effect then.')
     parser.add_argument(
         '--only-average',
         action='store_true',
@@ -63,7 +93,56 @@ def get_parser():
     parser.add_argument(
         '--no-cache',
         action='store_true',
-        help="Don't use cached results, always download new ones.")
+        help="Don't use cached results, always download new ones. "
+             "Downloaded results are processed as they arrive and are not "
+             "stored in the cache.")
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Update cached results with the changes updated in Gerrit '
+             'since they were downloaded, instead of using them as they are.')
+    parser.add_argument(
+        '--cache-dir',
+        default=None,
+        help='Directory of the cache shared by all the tools. '
+             'Default: %s' % cache_store.DEFAULT_CACHE_DIR)
+    parser.add_argument(
+        '--cache-max-size',
+        default=None,
+        help='Size the cache is kept under, by removing the least recently '
+             'used entries, e.g. "500M" or "2G". Default: 2G')
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=None,
+        help='Number of days after which cached results expire and are '
+             'downloaded again.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of Gerrit queries run concurrently when downloading '
+             'results. Default: 4')
+    parser.add_argument(
+        '--slice-days',
+        type=int,
+        default=gerrit_query.DEFAULT_SLICE_DAYS,
+        help='When downloading results with more than one worker, the query '
+             'is split into slices covering this many days each. '
+             'Default: %d' % gerrit_query.DEFAULT_SLICE_DAYS)
+    parser.add_argument(
+        '--transport',
+        default=None,
+        choices=transport.MODES,
+        help='How Gerrit is accessed: "live" (default), "record" to also '
+             'save every response in the fixtures directory, or "replay" to '
+             'serve saved responses without accessing the network.')
+    parser.add_argument(
+        '--fixtures-dir',
+        default=None,
+        help='Directory of the responses saved or served by the "record" '
+             'and "replay" transports. Default: %s' %
+             transport.DEFAULT_FIXTURES_DIR)
     parser.add_argument(
         '--verbose',
         action='store_true',
@@ -72,12 +151,40 @@ def get_parser():
         '--plot',
         action='store_true',
         help='Generate graphs directly by script.')
+    parser.add_argument(
+        '--export-charts',
+        default=None,
+        metavar='DIR',
+        help='Render charts to files in this directory, without a display. '
+             'Charts of the average number of rechecks per every time '
+             'window and of the rechecks of each patch are rendered, or in '
+             'batch mode a chart per every project, branch and time window. '
+             'Charts are rendered in parallel, long series are downsampled.')
+    parser.add_argument(
+        '--chart-format',
+        default='png',
+        choices=charts.FORMATS,
+        help='File format of the exported charts. Default: png')
     parser.add_argument(
         '--report-format',
         default='human',
+        choices=REPORT_FORMATS,
         help=('Format in which results will be printed. '
               'Default value: "human" '
-              'Possible values: "human", "csv"'))
+              'Possible values: "human", "csv", "jsonl". With '
+              '"--all-patches", "csv" and "jsonl" reports list the patches in '
+              'the order they were merged, unless "--top" is set. With '
+              '"--no-cache" too, and without "--top", they are written while '
+              'the patches are read from Gerrit, in no particular order, in '
+              'constant memory. "jsonl" is only supported with '
+              '"--all-patches".'))
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=None,
+        help='With "--all-patches", only report this many patches with the '
+             'most rechecks. Default for the "human" report format: %s' %
+             DEFAULT_HUMAN_TOP)
     parser.add_argument(
         '--branch',
         default='master',
@@ -86,200 +193,45 @@ def get_parser():
         '--project',
         default=None,
         help='The OpenStack project to query. For example openstack/neutron.')
+    parser.add_argument(
+        '--projects-file',
+        default=None,
+        help='Run in batch mode for every project listed in this file, one '
+             'per line (for example the output of tc_make_repos_list.py), '
+             'or read from the standard input if "-" is given. A single '
+             'report with every project and branch and the overall totals '
+             'is printed.')
+    parser.add_argument(
+        '--branches',
+        default='master',
+        help='Comma separated list of branches to check in batch mode. '
+             'Default: master')
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='Number of processes used to parse the results, or to handle '
+             'projects in batch mode. Default: number of CPUs')
 
-    return parser.parse_args()
-
-
-def _get_file_from_query(query):
-    return query.replace('/', '_')
-
-
-def get_json_data_from_cache(query):
-    try:
-        os.mkdir('cache')
-    except OSError:
-        pass
-
-    query = _get_file_from_query(query)
-    if query in os.listdir('cache'):
-        with open('cache/%s' % query) as query_file:
-            return json.load(query_file)
-
-
-def put_json_data_in_cache(query, data):
-    try:
-        os.mkdir('cache')
-    except OSError:
-        pass
-    query = _get_file_from_query(query)
-    with open('cache/%s' % query, 'w') as query_file:
-        json.dump(data, query_file)
-
-
-def get_json_data_from_query(query):
-    data = []
-    start = 0
-
-    while True:
-        gerrit_cmd = (
-            'ssh -p 29418 review.opendev.org gerrit query --format=json '
-            '--current-patch-set --comments --start %(start)s %(query)s' %
-            {'start': start,
-             'query': query})
-        result, error = exec_cmd(gerrit_cmd)
-
-        if error:
-            print(error)
-            sys.exit(1)
-
-        result = result.decode('utf-8')
-        lines = result.split('\n')[:-2]
-        data += [json.loads(line) for line in lines]
-
-        if not data:
-            print('No patches found!')
-            sys.exit(1)
-
-        log_debug('Found metadata for %s more patches, %s total so far' %
-                  (len(lines), len(data)))
-        start += len(lines)
-        more_changes = json.loads(result.split('\n')[-2])['moreChanges']
-        if not more_changes:
-            break
-
-    data = sorted(data, key=lambda x: x['createdOn'])
-    return data
+    args = parser.parse_args()
+    if args.report_format == 'jsonl' and not args.all_patches:
+        parser.error('"--report-format jsonl" requires "--all-patches"')
+    return args
 
 
-def get_submission_timestamp(patch):
-    try:
-        # Not all patches have approvals data
-        approvals = patch['currentPatchSet']['approvals']
-    except KeyError:
-        return patch['lastUpdated']
-
-    # Weirdly enough some patches don't have submission data.
-    # Take lastUpdated instead.
-    return next(
-        (approval['grantedOn'] for approval in approvals if
-         approval['type'] == 'SUBM'), patch['lastUpdated'])
-
-
-def get_points_from_data(data):
-
-    points = []
-    build_failed_regex = re.compile(
-        r"Build failed \((check|gate) pipeline\)")
-    ps_regex = re.compile(r"Patch Set (\d+)\:")
-
-    for patch in data:
-        last_ps = int(patch['currentPatchSet']['number'])
-        build_failures = 0
-        for comment in patch['comments']:
-            if comment['reviewer']['name'].lower() != 'zuul':
-                continue
-            msg = comment['message']
-            re_ps = re.search(ps_regex, msg)
-            if not re_ps:
-                log_debug("No patch set found for comment: %s" % msg)
-                continue
-            if int(re_ps.group(1)) != last_ps:
-                log_debug("Comment was not for last patch set. Skipping")
-                continue
-
-            if build_failed_regex.search(msg):
-                build_failures += 1
-
-        points.append(
-            {'id': patch['id'],
-             'merged': get_submission_timestamp(patch),
-             'build_failures': build_failures,
-             'project': patch['project'],
-             'url': patch['url'],
-             'subject': patch['subject']})
-    points = sorted(points, key = lambda i: i['merged'])
-    return points
-
-
-AVG_DATA_POINTS = None
-
-
-def get_avg_failures(points, time_window):
-    if time_window == 'week':
-        return get_avg_failures_per_week(points)
-    elif time_window == 'month':
-        return get_avg_failures_per_month(points)
-    else:
-        return get_avg_failures_per_year(points)
-
-
-def get_avg_failures_per_week(points):
-    global AVG_DATA_POINTS
-    if AVG_DATA_POINTS is None:
-        data = {}
-        for point in points:
-            point_date = datetime.date.fromtimestamp(point['merged'])
-            point_year, point_week, _ = point_date.isocalendar()
-            point_key = "%s-%s" % (point_year, point_week)
-            log_debug("Patch %s merged %s (week %s)" % (
-                point['id'], point_date, point_key))
-            if point_key not in data.keys():
-                data[point_key] = [point['build_failures']]
-            else:
-                data[point_key].append(point['build_failures'])
-
-        AVG_DATA_POINTS = {k: sum(v)/len(v) for k, v in data.items()}
-
-    return AVG_DATA_POINTS
-
-
-def get_avg_failures_per_month(points):
-    global AVG_DATA_POINTS
-    if AVG_DATA_POINTS is None:
-        data = {}
-        for point in points:
-            point_date = datetime.date.fromtimestamp(point['merged'])
-            point_key = "%s-%s" % (point_date.year, point_date.month)
-            log_debug("Patch %s merged %s (week %s)" % (
-                point['id'], point_date, point_key))
-            if point_key not in data.keys():
-                data[point_key] = [point['build_failures']]
-            else:
-                data[point_key].append(point['build_failures'])
-
-        AVG_DATA_POINTS = {k: sum(v)/len(v) for k, v in data.items()}
-
-    return AVG_DATA_POINTS
-
-
-def get_avg_failures_per_year(points):
-    global AVG_DATA_POINTS
-    if AVG_DATA_POINTS is None:
-        data = {}
-        for point in points:
-            point_date = datetime.date.fromtimestamp(point['merged'])
-            point_key = point_date.year
-            log_debug("Patch %s merged %s (week %s)" % (
-                point['id'], point_date, point_key))
-            if point_key not in data.keys():
-                data[point_key] = [point['build_failures']]
-            else:
-                data[point_key].append(point['build_failures'])
-
-        AVG_DATA_POINTS = {k: sum(v)/len(v) for k, v in data.items()}
-
-    return AVG_DATA_POINTS
+def get_patch_rechecks_chart(points, path=None):
+    return {'path': path,
+            'xlabel': 'patch merge time',
+            'ylabel': 'number of failed builds',
+            'series': [{
+                'label': 'Number of failed builds before patch merge',
+                'x': [datetime.datetime.fromtimestamp(patch['merged'])
+                      for patch in points],
+                'y': [patch['build_failures'] for patch in points]}]}
 
 
 def plot_patch_rechecks(points):
-    x_values = [patch['id'] for patch in points]
-    y_values = [patch['build_failures'] for patch in points]
-    plt.plot(x_values, y_values,
-             label='Number of failed builds before patch merge')
-    plt.xlabel('patch merge time')
-    plt.ylabel('number of failed builds')
-    plt.legend()
-    plt.show()
+    charts.show_chart(get_patch_rechecks_chart(points))
 
 
 def get_avg_number_or_rechecks(points):
@@ -289,27 +241,60 @@ def get_avg_number_or_rechecks(points):
     return build_failures / len(points)
 
 
+def get_top_patches(points, top):
+    # A bounded heap keeps only "top" points, instead of sorting all of them.
+    return heapq.nlargest(top, points, key=lambda x: x['build_failures'])
+
+
+def is_streaming():
+    # Only reports of every patch, in no particular order, can be written
+    # while the patches are read.
+    return (args.all_patches and args.no_cache and args.top is None and
+            args.report_format in STREAMING_FORMATS and
+            not (args.plot or args.export_charts or args.only_average or
+                 args.jobs_report))
+
+
 def print_patch_rechecks(points):
-    points = sorted(points, key=lambda x: x['build_failures'], reverse=True)
+    top = args.top
+    if top is None and args.report_format not in STREAMING_FORMATS:
+        top = DEFAULT_HUMAN_TOP
+    if top is not None:
+        avg_build_failures = get_avg_number_or_rechecks(points)
+        if top < len(points):
+            log_debug("Showing %s of %s patches" % (top, len(points)))
+        points = get_top_patches(points, top)
     if args.report_format == 'csv':
         print_rechecks_as_csv(points)
+    elif args.report_format == 'jsonl':
+        print_rechecks_as_jsonl(points)
     else:
-        print_rechecks_as_human_readable(points)
+        print_rechecks_as_human_readable(points, avg_build_failures)
 
 
 def print_rechecks_as_csv(points):
-    print("%s,Average number of failed builds" % time_window)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(PATCH_FIELDS)
     for patch_data in points:
-        print('%s,%s,%s,%s' % (patch_data['subject'],
-                            patch_data['url'],
-                            patch_data['project'],
-                            patch_data['build_failures']))
+        writer.writerow([patch_data['subject'],
+                         patch_data['url'],
+                         patch_data['project'],
+                         patch_data['build_failures']])
 
 
-def print_rechecks_as_human_readable(points):
+def print_rechecks_as_jsonl(points):
+    for patch_data in points:
+        print(json.dumps({'id': patch_data['id'],
+                          'subject': patch_data['subject'],
+                          'url': patch_data['url'],
+                          'project': patch_data['project'],
+                          'merged': patch_data['merged'],
+                          'rechecks': patch_data['build_failures']}))
+
+
+def print_rechecks_as_human_readable(points, avg_build_failures):
     table = PrettyTable()
-    table.field_names = ['Subject', 'URL', 'Project', 'Rechecks']
-    avg_build_failures = get_avg_number_or_rechecks(points)
+    table.field_names = PATCH_FIELDS
     avg_marker_drawed = False
     for patch_data in points:
         # Data is already sorted so we can draw marker in single place in table
@@ -328,75 +313,224 @@ def print_rechecks_as_human_readable(points):
              round(patch_data['build_failures'], 2)])
     print(table)
 
-def plot_avg_rechecks(points, time_window):
-    plot_points = get_avg_failures(points, time_window)
-    x_values = list(plot_points.keys())
-    y_values = list(plot_points.values())
-    plt.plot(x_values, y_values,
-             label=('Average number of failed builds '
-                    'before patch merge per %s' % time_window))
-    plt.xlabel('patch merge time')
-    plt.ylabel('number of failed builds')
-    plt.legend()
-    plt.xticks(x_values, x_values, rotation='vertical')
-    plt.show()
-
-
-def print_avg_rechecks(points, time_window):
-    plot_points = get_avg_failures(points, time_window)
+
+def get_window_title(time_window):
+    if args.rolling_days:
+        return "%s (last %s days)" % (time_window, args.rolling_days)
+    return time_window
+
+
+def get_avg_rechecks_chart(plot_points, time_window, path=None,
+                           title=None):
+    return {'path': path,
+            'title': title,
+            'xlabel': 'patch merge time',
+            'ylabel': 'number of failed builds',
+            'series': [{
+                'label': ('Average number of failed builds '
+                          'before patch merge per %s' %
+                          get_window_title(time_window)),
+                'x': [str(bucket) for bucket in plot_points.keys()],
+                'y': list(plot_points.values())}]}
+
+
+def plot_avg_rechecks(aggregator, time_window):
+    plot_points = aggregator.get_means(time_window, args.rolling_days)
+    charts.show_chart(get_avg_rechecks_chart(plot_points, time_window))
+
+
+def export_rechecks_charts(points, aggregator):
+    specs = [get_avg_rechecks_chart(
+                 aggregator.get_means(time_window, args.rolling_days),
+                 time_window,
+                 charts.get_chart_path(args.export_charts,
+                                       'rechecks-%s' % time_window,
+                                       args.chart_format))
+             for time_window in aggregate.TIME_WINDOWS]
+    specs.append(get_patch_rechecks_chart(
+        points, charts.get_chart_path(args.export_charts, 'rechecks-patches',
+                                      args.chart_format)))
+    for path in charts.export_charts(specs, args.processes):
+        log_debug("Chart saved to %s" % path)
+
+
+def export_batch_charts(series):
+    specs = []
+    for (project, branch), windows in series.items():
+        for time_window, plot_points in windows.items():
+            name = '%s-%s-%s' % (project, branch, time_window)
+            specs.append(get_avg_rechecks_chart(
+                plot_points, time_window,
+                charts.get_chart_path(args.export_charts, name,
+                                      args.chart_format),
+                title='%s (%s)' % (project, branch)))
+    for path in charts.export_charts(specs, args.processes):
+        log_debug("Chart saved to %s" % path)
+
+
+def print_avg_rechecks(aggregator, time_window):
+    stats = aggregator.get_stats(time_window, args.rolling_days)
     if args.report_format == 'csv':
-        print_avg_as_csv(plot_points, time_window)
+        print_avg_as_csv(stats, time_window)
     else:
-        print_avg_as_human_readable(plot_points, time_window)
+        print_avg_as_human_readable(stats, time_window)
 
 
-def print_avg_as_csv(points, time_window):
-    print("%s,Average number of failed builds" % time_window)
-    for week, value in points.items():
-        print('%s,%s' % (week, value))
+def print_avg_as_csv(stats, time_window):
+    print("%s,Average number of failed builds,Median,90th percentile,"
+          "Patches" % get_window_title(time_window))
+    for bucket, bucket_stats in stats.items():
+        print('%s,%s,%s,%s,%s' % (bucket, bucket_stats.mean,
+                                  bucket_stats.median, bucket_stats.p90,
+                                  bucket_stats.count))
 
 
-def print_avg_as_human_readable(points, time_window):
+def print_avg_as_human_readable(stats, time_window):
     table = PrettyTable()
-    table.field_names = [time_window, "Rechecks"]
-    for week, value in points.items():
-        table.add_row([week, round(value, 2)])
+    table.field_names = [get_window_title(time_window), "Rechecks",
+                         "Median", "p90", "Patches"]
+    for bucket, bucket_stats in stats.items():
+        table.add_row([bucket, round(bucket_stats.mean, 2),
+                       round(bucket_stats.median, 2),
+                       round(bucket_stats.p90, 2), bucket_stats.count])
     print(table)
 
 
-if __name__ == '__main__':
-    args = get_parser()
-    query = "status:merged branch:%s " % args.branch
-    if args.project:
-        query += 'project:%s ' % args.project
-    if args.newer_than:
-        query += ' -- -age:%dd' % int(args.newer_than)
+def print_job_failures(job_failures):
+    if args.report_format == 'csv':
+        print_job_failures_as_csv(job_failures)
+    else:
+        print_job_failures_as_human_readable(job_failures)
+
+
+def _get_failure_rate(failures, successes):
+    return 100 * failures / (failures + successes)
+
+
+def print_job_failures_as_csv(job_failures):
+    print("Job,Rechecks caused,Successful runs,Failure rate")
+    for job, failures, successes in job_failures:
+        print('%s,%s,%s,%s' % (job, failures, successes,
+                               _get_failure_rate(failures, successes)))
+
+
+def print_job_failures_as_human_readable(job_failures):
+    table = PrettyTable()
+    table.field_names = ['Job', 'Rechecks caused', 'Successful runs',
+                         'Failure rate [%]']
+    table.align['Job'] = 'l'
+    for job, failures, successes in job_failures:
+        table.add_row([job, failures, successes,
+                       round(_get_failure_rate(failures, successes), 2)])
+    print(table)
+
+
+def print_batch_report(results, totals):
+    if args.report_format == 'csv':
+        print_batch_as_csv(results, totals)
+    else:
+        print_batch_as_human_readable(results, totals)
+
+
+def _round(value):
+    return '-' if value is None else round(value, 2)
+
+
+def print_batch_as_csv(results, totals):
+    print("Project,Branch,Patches,Failed builds,"
+          "Average number of failed builds,Median,90th percentile")
+    for result in results + [totals]:
+        print(','.join('' if value is None else str(value)
+                       for value in result))
+
+
+def print_batch_as_human_readable(results, totals):
+    table = PrettyTable()
+    table.field_names = ['Project', 'Branch', 'Patches', 'Failed builds',
+                         'Rechecks', 'Median', 'p90']
+    for result in results + [totals]:
+        table.add_row([result.project, result.branch, result.patches,
+                       result.build_failures, _round(result.average),
+                       _round(result.median), _round(result.p90)])
+    print(table)
+
+
+def main():
+    logging.basicConfig(
+        format='%(message)s',
+        level=logging.DEBUG if args.verbose else logging.WARNING)
+    transport.configure(args.transport, args.fixtures_dir)
+    cache_store.configure(args.cache_dir, args.cache_max_size)
+
+    options = {'no_cache': args.no_cache,
+               'refresh': args.refresh,
+               'workers': args.workers,
+               'slice_days': args.slice_days,
+               'newer_than': args.newer_than,
+               'cache_ttl': args.cache_ttl and args.cache_ttl * 86400}
+
+    if args.projects_file:
+        time_windows = aggregate.TIME_WINDOWS if args.export_charts else ()
+        results, totals, series = batch.run_batch(
+            batch.read_projects(args.projects_file),
+            args.branches.split(','), args.processes, options,
+            time_windows, args.rolling_days,
+            settings={'transport': args.transport,
+                      'fixtures_dir': args.fixtures_dir,
+                      'cache_dir': args.cache_dir,
+                      'cache_max_size': args.cache_max_size})
+        if args.export_charts:
+            export_batch_charts(series)
+        print_batch_report(results, totals)
+        sys.exit(0)
 
+    query = recheck_points.get_query(
+        args.branch, args.project, args.newer_than)
     log_debug("Query: %s" % query)
-    data = None
-    if not args.no_cache:
-        data = get_json_data_from_cache(query)
-    if not data:
-        data = get_json_data_from_query(query)
-        put_json_data_in_cache(query, data)
+    if is_streaming():
+        points = recheck_points.iter_points(
+            query, args.workers, args.slice_days, args.newer_than)
+        first = next(points, None)
+        if first is None:
+            print('No patches found!')
+            sys.exit(1)
+        print_patch_rechecks(itertools.chain([first], points))
+        sys.exit(0)
 
-    points = get_points_from_data(data)
+    points = recheck_points.get_points(
+        query, processes=args.processes, **options)
 
     if not points:
-        error = 'Could not parse points from data. It is likely that the ' \
-                'createdOn timestamp of the patches found is bogus.'
-        print(error)
+        print('No patches found!')
         sys.exit(1)
 
     if args.only_average:
         print(round(get_avg_number_or_rechecks(points), 2))
         sys.exit(0)
 
+    if args.jobs_report:
+        print_job_failures(recheck_points.get_job_failures(points))
+        sys.exit(0)
+
+    aggregator = aggregate.PointsAggregator(points)
+    if args.export_charts:
+        export_rechecks_charts(points, aggregator)
+
     if args.all_patches:
         if args.plot:
             plot_patch_rechecks(points)
         print_patch_rechecks(points)
     else:
         if args.plot:
-            plot_avg_rechecks(points, args.time_window)
-        print_avg_rechecks(points, args.time_window)
+            plot_avg_rechecks(aggregator, args.time_window)
+        print_avg_rechecks(aggregator, args.time_window)
+
+
+if __name__ == '__main__':
+    args = get_parser()
+    try:
+        main()
+    except transport.TransportError as e:
+        # Gerrit couldn't be queried.
+        print(e)
+        sys.exit(1)
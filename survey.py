@@ -0,0 +1,300 @@
+import array
+import csv
+import multiprocessing
+import os
+
+import numpy as np
+
+
+ENCODING = "utf-8"
+# Many responses to one question are separated by this.
+SEPARATOR = "|"
+# Files bigger than this are split into chunks loaded by separate
+# processes.
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+
+def iter_lines(data, end=None):
+    """Yield decoded lines of a file opened in binary mode, up to an offset.
+
+    New lines are translated like in text mode.
+    """
+    position = data.tell()
+    for line in data:
+        position += len(line)
+        if line.endswith(b'\r\n'):
+            line = line[:-2] + b'\n'
+        yield line.decode(ENCODING)
+        if end is not None and position >= end:
+            return
+
+
+def read_header(csv_file):
+    """Return the questions and the offset where the answers start."""
+    with open(csv_file, 'rb') as data:
+        lines = []
+        quotes = 0
+        # The header ends with the first new line outside of quotes.
+        while True:
+            line = data.readline()
+            lines.append(line.decode(ENCODING))
+            quotes += line.count(b'"')
+            if not line or quotes % 2 == 0:
+                break
+        header = next(csv.reader(lines, delimiter=',', quotechar='"'), [])
+        return header, data.tell()
+
+
+def get_chunks(csv_file, start, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Split the rows of the file after the start offset into byte ranges.
+
+    Every range is about chunk_size bytes long and ends right after a new
+    line which isn't in a quoted answer, i.e. which follows an even number
+    of quotes. Only quotes and new lines are looked for, the rows aren't
+    parsed.
+    """
+    size = os.path.getsize(csv_file)
+    chunks = []
+    chunk_start = start
+    target = start + chunk_size
+    quotes = 0
+    offset = start
+    with open(csv_file, 'rb') as data:
+        data.seek(start)
+        while target < size:
+            block = data.read(BLOCK_SIZE)
+            if not block:
+                break
+            index = max(target - offset, 0)
+            counted = 0
+            block_quotes = quotes
+            while index < len(block):
+                index = block.find(b'\n', index)
+                if index == -1:
+                    break
+                block_quotes += block.count(b'"', counted, index)
+                counted = index
+                index += 1
+                if block_quotes % 2 == 0:
+                    chunks.append((chunk_start, offset + index))
+                    chunk_start = offset + index
+                    target = chunk_start + chunk_size
+                    index = max(index, target - offset)
+            quotes += block.count(b'"')
+            offset += len(block)
+    if chunk_start < size:
+        chunks.append((chunk_start, size))
+    return chunks
+
+
+def load_chunk(chunk):
+    """Code the answers in a byte range of the file.
+
+    Returns the number of rows and, for every question, its responses in
+    the order they first appear in and arrays of the rows and codes of all
+    the responses.
+    """
+    csv_file, start, end, questions_count = chunk
+    categories = [{} for _ in range(questions_count)]
+    rows = [array.array('i') for _ in range(questions_count)]
+    codes = [array.array('i') for _ in range(questions_count)]
+    rows_count = 0
+    with open(csv_file, 'rb') as data:
+        data.seek(start)
+        for row in csv.reader(iter_lines(data, end), delimiter=',',
+                              quotechar='"'):
+            for i, answer in enumerate(row[:questions_count]):
+                if not answer:
+                    continue
+                question_categories = categories[i]
+                for response in answer.split(SEPARATOR):
+                    code = question_categories.get(response)
+                    if code is None:
+                        code = question_categories[response] = len(
+                            question_categories)
+                    rows[i].append(rows_count)
+                    codes[i].append(code)
+            rows_count += 1
+    return rows_count, [
+        (list(question_categories), np.frombuffer(question_rows, np.int32),
+         np.frombuffer(question_codes, np.int32))
+        for question_categories, question_rows, question_codes in zip(
+            categories, rows, codes)]
+
+
+class Column(object):
+    """Answers of all the respondents to one question, coded as integers.
+
+    Every distinct response gets a code, in the order it first appears in.
+    A respondent can give many responses to a question, so the answers are
+    kept as the respondent and the code of every response, i.e. as the
+    non-zero cells of an indicator matrix of respondents and responses.
+    """
+
+    def __init__(self, question, categories, respondents, codes, size):
+        self.question = question
+        self.categories = categories
+        self.respondents = respondents
+        self.codes = codes
+        self.size = size
+
+    def get_counts(self):
+        return np.bincount(self.codes, minlength=len(self.categories))
+
+    def get_answered(self):
+        answered = np.zeros(self.size, dtype=bool)
+        answered[self.respondents] = True
+        return answered
+
+    def get_responses_counts(self):
+        """Return the number of responses of every respondent."""
+        return np.bincount(self.respondents, minlength=self.size)
+
+
+class ColumnBuilder(object):
+    """Merges codes of a question from the chunks of the file, in order."""
+
+    def __init__(self, question):
+        self.question = question
+        self.categories = {}
+        self.respondents = []
+        self.codes = []
+
+    def add(self, offset, categories, respondents, codes):
+        if not len(codes):
+            return
+        # Codes of the chunk are translated to codes of the whole file.
+        translation = np.array(
+            [self.categories.setdefault(category, len(self.categories))
+             for category in categories], dtype=np.int32)
+        self.respondents.append(respondents + offset)
+        self.codes.append(translation[codes])
+
+    def build(self, size):
+        def concatenate(arrays):
+            if not arrays:
+                return np.zeros(0, dtype=np.int32)
+            return np.concatenate(arrays)
+
+        return Column(self.question, list(self.categories),
+                      concatenate(self.respondents),
+                      concatenate(self.codes), size)
+
+
+class Survey(object):
+    """Answers to all the questions of a survey export, by columns."""
+
+    def __init__(self, columns, size):
+        self.columns = columns
+        self.size = size
+        # Later columns win when questions are repeated, like in a dict.
+        self._by_question = {column.question: column for column in columns}
+
+    @classmethod
+    def load(cls, csv_file, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Read the CSV export once, coding all the answers.
+
+        Big files are split into chunks coded by a pool of processes, which
+        are then merged in order.
+        """
+        questions, start = read_header(csv_file)
+        chunks = [(csv_file, chunk_start, chunk_end, len(questions))
+                  for chunk_start, chunk_end in get_chunks(
+                      csv_file, start, chunk_size)]
+        builders = [ColumnBuilder(question) for question in questions]
+        size = 0
+        if len(chunks) < 2 or processes == 1:
+            results = map(load_chunk, chunks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap(load_chunk, chunks)
+        try:
+            for rows_count, chunk_columns in results:
+                for builder, chunk_column in zip(builders, chunk_columns):
+                    builder.add(size, *chunk_column)
+                size += rows_count
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return cls([builder.build(size) for builder in builders], size)
+
+    @property
+    def questions(self):
+        return [column.question for column in self.columns]
+
+    def get_column(self, question):
+        """Return the column of the question.
+
+        The question can also be given by a part of it, if only one
+        question contains it, ignoring case.
+        """
+        if question in self._by_question:
+            return self._by_question[question]
+        matches = [column for column in self.columns
+                   if question.lower() in column.question.lower()]
+        if len(matches) != 1:
+            raise KeyError('%s questions match "%s"' % (
+                len(matches) or 'No', question))
+        return matches[0]
+
+    def get_counts(self, questions, categories):
+        """Count the given responses to every one of the questions.
+
+        Returns a matrix with a row for every question.
+        """
+        counts = np.zeros((len(questions), len(categories)), dtype=np.int64)
+        for row, question in enumerate(questions):
+            column = self.get_column(question)
+            codes = {category: code
+                     for code, category in enumerate(column.categories)}
+            present = [i for i, category in enumerate(categories)
+                       if category in codes]
+            counts[row, present] = column.get_counts()[
+                [codes[categories[i]] for i in present]]
+        return counts
+
+    def crosstab(self, question, other_question):
+        """Count respondents by their responses to two questions.
+
+        Returns responses to both questions and a matrix with a row for
+        every response to the first one and a column for every response to
+        the second one. The last row and column count respondents who
+        answered the other question at all, so the last cell is the number
+        of respondents who answered both.
+        """
+        column = self.get_column(question)
+        other_column = self.get_column(other_question)
+        other_size = len(other_column.categories) + 1
+
+        # Every response to the first question is paired with every
+        # response of the same respondent to the other one.
+        counts = column.get_responses_counts()
+        other_counts = other_column.get_responses_counts()
+        order = np.argsort(other_column.respondents, kind='stable')
+        other_starts = np.cumsum(other_counts) - other_counts
+        repeats = other_counts[column.respondents]
+        total = int(repeats.sum())
+        pair_starts = np.repeat(np.cumsum(repeats) - repeats, repeats)
+        other_index = (np.repeat(other_starts[column.respondents], repeats) +
+                       np.arange(total) - pair_starts)
+        codes = (np.repeat(column.codes, repeats) * other_size +
+                 other_column.codes[order[other_index]])
+
+        # The margins: responses of the respondents who answered the other
+        # question, and the respondents who answered both.
+        answered = (counts > 0)[other_column.respondents]
+        other_answered = (other_counts > 0)[column.respondents]
+        codes = np.concatenate([
+            codes,
+            column.codes[other_answered] * other_size + other_size - 1,
+            len(column.categories) * other_size +
+            other_column.codes[answered],
+            np.full(int(np.count_nonzero((counts > 0) & (other_counts > 0))),
+                    (len(column.categories) + 1) * other_size - 1)])
+        counts = np.bincount(
+            codes, minlength=(len(column.categories) + 1) * other_size)
+        return (column.categories, other_column.categories,
+                counts.reshape(-1, other_size).astype(np.int64))
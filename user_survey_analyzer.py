@@ -1,11 +1,15 @@
 #!/bin/env python
 
-import csv
+import argparse
 import collections
+import csv
+import multiprocessing
 import sys
 
 from prettytable import PrettyTable
 
+import survey
+
 
 TOTAL_COUNT = "All Responses"
 RESPONSE_TITLE = "Response"
@@ -13,38 +17,98 @@ COUNT_TITLE = "Users"
 PERCENTAGE_TITLE = "Percentage of Responses"
 
 
-def get_data_in_lists(csv_file):
-    # This returns data in list of lists in format like:
-    # [['Question 1', 'Answear', 'Answear', ... ],
-    #  ['Question 2', 'Answear', 'Answear', ... ]]
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Count answers to every question of the User Survey.')
+    parser.add_argument('csv_file')
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='Number of processes reading chunks of big files. '
+             'Default: number of CPUs')
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=survey.DEFAULT_CHUNK_SIZE // (1024 * 1024),
+        help='Size of the chunks of the file, in MiB. Default: %d' % (
+            survey.DEFAULT_CHUNK_SIZE // (1024 * 1024)))
+    parser.add_argument(
+        '--crosstab',
+        nargs=2,
+        metavar='QUESTION',
+        help='Instead of counting answers to every question, count '
+             'respondents by their answers to two questions, e.g. '
+             '"ProjectsUsed - Neutron" and "deployment size". Questions can '
+             'be given by any unique part of them.')
+    return parser.parse_args()
+
+
+def count_answers(rows, questions_count):
+    """Count answers to every question in the rows.
 
-    result_data = []
-    with open(csv_file) as data:
-        raw_data = list(csv.reader(data, delimiter=',', quotechar='"'))
-        result_data = [[question] for question in raw_data[0]]
-        for row in raw_data[1:]:
-            for i, element in enumerate(row):
-                if element:
-                    result_data[i].append(element)
-    return result_data
+    Every answer may be a few responses separated by "|", each of them is
+    counted, and TOTAL_COUNT counts the answers. Returns counts of the
+    responses to every question, in the order of the columns.
+    """
+    counters = [collections.defaultdict(int) for _ in range(questions_count)]
+    for row in rows:
+        for counter, answer in zip(counters, row):
+            if answer:
+                for response in answer.split(survey.SEPARATOR):
+                    counter[response] += 1
+                counter[TOTAL_COUNT] += 1
+    return counters
 
 
-def convert_data_to_dicts(data):
-    questions = {}
-    for row in data:
-        header = row[0]
-        questions[header] = collections.defaultdict(int)
-        for responses in row[1:]:
-            for response in responses.split("|"):
-                questions[header][response] += 1
-            questions[header][TOTAL_COUNT] += 1
-    return questions
+def count_chunk(chunk):
+    csv_file, start, end, questions_count = chunk
+    with open(csv_file, 'rb') as data:
+        data.seek(start)
+        rows = csv.reader(survey.iter_lines(data, end), delimiter=',',
+                          quotechar='"')
+        return count_answers(rows, questions_count)
+
+
+def count_file(csv_file, processes=None,
+               chunk_size=survey.DEFAULT_CHUNK_SIZE):
+    """Count answers to every question in the survey export.
+
+    Unlike survey.Survey, which keeps every response for cross-tabs, rows
+    are read one at a time and only the counters are kept, so memory
+    depends on the number of distinct responses, not of respondents. Big
+    files are split into chunks counted by a pool of processes, whose
+    counters are then merged. Returns counts of the responses by question.
+    """
+    questions, start = survey.read_header(csv_file)
+    chunks = [(csv_file, chunk_start, chunk_end, len(questions))
+              for chunk_start, chunk_end in survey.get_chunks(
+                  csv_file, start, chunk_size)]
+    counters = [collections.defaultdict(int) for _ in questions]
+    if len(chunks) < 2 or processes == 1:
+        results = map(count_chunk, chunks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        # Chunks are merged in order, so responses stay in the order they
+        # first appear in.
+        results = pool.imap(count_chunk, chunks)
+    try:
+        for chunk_counters in results:
+            for counter, chunk_counter in zip(counters, chunk_counters):
+                for response, count in chunk_counter.items():
+                    counter[response] += count
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return dict(zip(questions, counters))
 
 
 def print_data(data):
     for question, responses in data.items():
         print(f"Question: {question}")
-        all_responses = responses.pop(TOTAL_COUNT)
+        all_responses = responses.pop(TOTAL_COUNT, 0)
         print(f"Total number of responses: {all_responses}")
         table = PrettyTable(
             [RESPONSE_TITLE, COUNT_TITLE, PERCENTAGE_TITLE])
@@ -62,8 +126,26 @@ def print_data(data):
         print(table)
 
 
+def print_crosstab(data, question, other_question):
+    rows, columns, counts = data.crosstab(question, other_question)
+    print(f"Question: {data.get_column(question).question}")
+    print(f"By: {data.get_column(other_question).question}")
+    table = PrettyTable([RESPONSE_TITLE] + columns + [TOTAL_COUNT])
+    table.align[RESPONSE_TITLE] = "l"
+    for response, row in zip(rows + [TOTAL_COUNT], counts.tolist()):
+        table.add_row([response] + row)
+    print(table)
+
+
 if __name__ == '__main__':
-    csv_file = sys.argv[1]
-    data_lists = get_data_in_lists(csv_file)
-    data_dict = convert_data_to_dicts(data_lists)
-    print_data(data_dict)
+    args = get_parser()
+    chunk_size = args.chunk_size * 1024 * 1024
+    if args.crosstab:
+        data = survey.Survey.load(args.csv_file, args.processes, chunk_size)
+        try:
+            print_crosstab(data, *args.crosstab)
+        except KeyError as e:
+            print(e.args[0])
+            sys.exit(1)
+    else:
+        print_data(count_file(args.csv_file, args.processes, chunk_size))